@@ -1,9 +1,12 @@
 
 import http.client
 import hashlib
+import socket
 import time
 import statistics
 import json
+import argparse
+import threading
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple
@@ -29,22 +32,130 @@ ENDPOINTS = [
     '/'
 ]
 
+class SlowClients:
+    """Clientes deliberadamente lentos rodando em segundo plano.
+
+    Metade manda o cabeçalho um byte por vez sem nunca terminá-lo (slowloris)
+    e metade pede um arquivo grande e lê poucos bytes por intervalo. Cada um
+    reconecta quando o servidor encerra a conexão por timeout; `disconnects`
+    conta esses encerramentos.
+    """
+    def __init__(self, host: str, port: int, count: int, interval: float = 0.5):
+        self.host = host
+        self.port = port
+        self.count = count
+        self.interval = interval
+        self.disconnects = 0
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.lock = threading.Lock()
+    
+    def start(self):
+        for i in range(self.count):
+            client = self.slow_headers if i % 2 == 0 else self.slow_reader
+            thread = threading.Thread(target=self.run, args=(client,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+    
+    def run(self, client):
+        """Repete o cliente lento até o fim do teste"""
+        while not self.stop_event.is_set():
+            try:
+                closed = client()
+            except ConnectionError:
+                closed = True
+            except OSError:
+                # Falha ao conectar: espera antes de tentar de novo
+                closed = False
+                self.stop_event.wait(self.interval)
+            if closed:
+                with self.lock:
+                    self.disconnects += 1
+    
+    def request_head(self, endpoint: str) -> bytes:
+        return (f"GET {endpoint} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"X-Custom-ID: {X_CUSTOM_ID}\r\n").encode()
+    
+    def slow_headers(self) -> bool:
+        """Cabeçalho infinito, um byte por intervalo; True se o servidor desistiu"""
+        with socket.create_connection((self.host, self.port), timeout=10) as sock:
+            sock.sendall(self.request_head('/small.txt'))
+            trickle = b'X-Slow: 1\r\n'
+            sent = 0
+            while not self.stop_event.wait(self.interval):
+                sock.sendall(trickle[sent % len(trickle):][:1])
+                sent += 1
+                try:
+                    # Qualquer resposta (ou EOF) antes do fim do cabeçalho é o servidor desistindo
+                    sock.recv(4096, socket.MSG_DONTWAIT)
+                    return True
+                except BlockingIOError:
+                    pass
+        return False
+    
+    def slow_reader(self) -> bool:
+        """Download grande lido 256 bytes por intervalo; True se o servidor fechou"""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            # Janela de recepção pequena: o servidor logo fica sem espaço para enviar
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.settimeout(10)
+            sock.connect((self.host, self.port))
+            sock.sendall(self.request_head('/xlarge.txt') + b'Connection: close\r\n\r\n')
+            while not self.stop_event.wait(self.interval):
+                if not sock.recv(256):
+                    return True
+        return False
+
 class LoadTester:
-    def __init__(self, server_name: str, host: str, port: int):
+    def __init__(self, server_name: str, host: str, port: int, keepalive: bool = False,
+                 compress: bool = False):
         self.server_name = server_name
         self.host = host
         self.port = port
+        self.keepalive = keepalive
+        # Cabeçalhos extras enviados em toda requisição (ex.: validadores)
+        self.extra_headers = {}
+        if compress:
+            # Corpos comprimidos: response_size passa a medir bytes na rede
+            self.extra_headers['Accept-Encoding'] = 'gzip'
         self.results = []
+        # Uma conexão persistente por thread quando keep-alive está ativo
+        self.local = threading.local()
+    
+    def get_connection(self) -> http.client.HTTPConnection:
+        """Retorna a conexão da thread atual (reutilizada em modo keep-alive)"""
+        if not self.keepalive:
+            return http.client.HTTPConnection(self.host, self.port, timeout=10)
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            self.local.conn = conn
+        return conn
+    
+    def release_connection(self, conn: http.client.HTTPConnection, reusable: bool):
+        """Fecha a conexão, a menos que ela possa ser reutilizada"""
+        if self.keepalive and reusable:
+            return
+        conn.close()
+        if getattr(self.local, 'conn', None) is conn:
+            self.local.conn = None
     
     def make_request(self, endpoint: str) -> Dict:
         """Faz uma requisição HTTP e retorna métricas"""
         start_time = time.time()
+        conn = None
         
         try:
-            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn = self.get_connection()
             headers = {
                 'X-Custom-ID': X_CUSTOM_ID,
-                'User-Agent': f'LoadTester-{MATRICULA}'
+                'User-Agent': f'LoadTester-{MATRICULA}',
+                **self.extra_headers
             }
             
             conn.request('GET', endpoint, headers=headers)
@@ -59,14 +170,16 @@ class LoadTester:
                 'status_code': response.status,
                 'latency_ms': latency,
                 'response_size': len(data),
-                'success': 200 <= response.status < 300,
+                'success': 200 <= response.status < 300 or response.status == 304,
                 'timestamp': datetime.now().isoformat()
             }
             
-            conn.close()
+            self.release_connection(conn, not response.will_close)
             return result
             
         except Exception as e:
+            if conn is not None:
+                self.release_connection(conn, False)
             end_time = time.time()
             return {
                 'endpoint': endpoint,
@@ -78,6 +191,90 @@ class LoadTester:
                 'timestamp': datetime.now().isoformat()
             }
     
+    def prime_validators(self, endpoint: str) -> Dict[str, str]:
+        """Baixa o recurso uma vez e retorna os cabeçalhos para revalidá-lo"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            conn.request('GET', endpoint, headers={'X-Custom-ID': X_CUSTOM_ID, **self.extra_headers})
+            response = conn.getresponse()
+            response.read()
+        finally:
+            conn.close()
+        validators = {}
+        if response.getheader('ETag'):
+            validators['If-None-Match'] = response.getheader('ETag')
+        if response.getheader('Last-Modified'):
+            validators['If-Modified-Since'] = response.getheader('Last-Modified')
+        return validators
+    
+    def fetch_range(self, endpoint: str, start: int, end: int) -> Tuple[int, int]:
+        """Baixa o intervalo [start, end] numa conexão própria; retorna (status, bytes)"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            headers = {
+                'X-Custom-ID': X_CUSTOM_ID,
+                'User-Agent': f'LoadTester-{MATRICULA}',
+                'Range': f'bytes={start}-{end}'
+            }
+            conn.request('GET', endpoint, headers=headers)
+            response = conn.getresponse()
+            return response.status, len(response.read())
+        finally:
+            conn.close()
+    
+    def make_segmented_download(self, endpoint: str, segments: int) -> Dict:
+        """Baixa um arquivo em `segments` intervalos (Range) por conexões paralelas"""
+        start_time = time.time()
+        
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            conn.request('HEAD', endpoint, headers={'X-Custom-ID': X_CUSTOM_ID})
+            head = conn.getresponse()
+            head.read()
+            conn.close()
+            size = int(head.getheader('Content-Length', '0'))
+            
+            step = max(-(-size // segments), 1)
+            bounds = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+            with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+                parts = list(executor.map(lambda b: self.fetch_range(endpoint, *b), bounds))
+            
+            end_time = time.time()
+            received = sum(length for _, length in parts)
+            success = (head.status == 200 and received == size
+                       and all(status == 206 for status, _ in parts))
+            return {
+                'endpoint': endpoint,
+                'status_code': 206 if success else max(status for status, _ in parts),
+                'latency_ms': (end_time - start_time) * 1000,
+                'response_size': received,
+                'success': success,
+                'timestamp': datetime.now().isoformat()
+            }
+            
+        except Exception as e:
+            end_time = time.time()
+            return {
+                'endpoint': endpoint,
+                'status_code': 0,
+                'latency_ms': (end_time - start_time) * 1000,
+                'response_size': 0,
+                'success': False,
+                'error': str(e),
+                'timestamp': datetime.now().isoformat()
+            }
+    
+    def run_segmented_test(self, endpoint: str, num_downloads: int, segments: int) -> List[Dict]:
+        """Executa downloads segmentados sequenciais, cada um em `segments` conexões"""
+        print(f"  [{self.server_name}] Download segmentado: {num_downloads} downloads de {endpoint} em {segments} conexões")
+        results = []
+        
+        for i in range(num_downloads):
+            results.append(self.make_segmented_download(endpoint, segments))
+            print(f"    Progresso: {i + 1}/{num_downloads}")
+        
+        return results
+    
     def run_sequential_test(self, endpoint: str, num_requests: int) -> List[Dict]:
         """Executa teste sequencial"""
         print(f"  [{self.server_name}] Teste sequencial: {num_requests} requisições para {endpoint}")
@@ -133,13 +330,17 @@ class LoadTester:
             'total_requests': len(results),
             'successful': len(successful),
             'failed': len(failed),
+            'not_modified': sum(1 for r in successful if r['status_code'] == 304),
             'success_rate': (len(successful) / len(results)) * 100,
             'latency_mean_ms': statistics.mean(latencies),
             'latency_median_ms': statistics.median(latencies),
             'latency_stdev_ms': statistics.stdev(latencies) if len(latencies) > 1 else 0,
             'latency_min_ms': min(latencies),
             'latency_max_ms': max(latencies),
-            'total_response_size': sum(r['response_size'] for r in successful)
+            'total_response_size': sum(r['response_size'] for r in successful),
+            # Vazão: bytes recebidos por segundo de requisição (no download
+            # segmentado cada resultado é um arquivo inteiro em N conexões)
+            'throughput_mb_s': sum(r['response_size'] for r in successful) / max(sum(latencies) / 1000, 1e-9) / 1e6
         }
 
 def format_results_to_txt(test_name: str, server_results: Dict[str, Dict]) -> str:
@@ -168,6 +369,16 @@ def format_results_to_txt(test_name: str, server_results: Dict[str, Dict]) -> st
             lines.append(f"Latência mínima: {stats['latency_min_ms']:.2f} ms")
             lines.append(f"Latência máxima: {stats['latency_max_ms']:.2f} ms")
             lines.append(f"Tamanho total de resposta: {stats['total_response_size']} bytes")
+            lines.append(f"Vazão média: {stats['throughput_mb_s']:.2f} MB/s")
+            if stats['not_modified']:
+                lines.append(f"Respostas 304 (revalidadas): {stats['not_modified']}")
+        if stats.get('slow_clients'):
+            lines.append(f"Clientes lentos ativos: {stats['slow_clients']} "
+                         f"(conexões encerradas pelo servidor: {stats['slow_disconnects']})")
+            lines.append(f"Taxa de falha dos clientes normais: "
+                         f"{stats['failed'] / stats['total_requests'] * 100:.2f}%")
+            lines.append(f"Taxa de 503 dos clientes normais: "
+                         f"{stats['overloaded'] / stats['total_requests'] * 100:.2f}%")
         
         lines.append("")
     
@@ -176,11 +387,27 @@ def format_results_to_txt(test_name: str, server_results: Dict[str, Dict]) -> st
     
     return "\n".join(lines)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Testes de carga dos servidores web')
+    parser.add_argument('--keepalive', action='store_true',
+                        help='reutiliza conexões HTTP/1.1 persistentes em cada thread')
+    parser.add_argument('--compress', action='store_true',
+                        help='pede corpos comprimidos (Accept-Encoding: gzip)')
+    parser.add_argument('--segments', type=int, default=4,
+                        help='conexões paralelas do download segmentado (Teste 11)')
+    parser.add_argument('--slow-clients', type=int, default=0,
+                        help='clientes lentos (slowloris e leitura lenta) ativos no Teste 13; 0 omite o teste')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     print(f"=== TESTE DE CARGA DE SERVIDORES WEB ===")
     print(f"Aluno: {NOME}")
     print(f"Matrícula: {MATRICULA}")
     print(f"X-Custom-ID: {X_CUSTOM_ID}")
+    print(f"Keep-alive: {'sim' if args.keepalive else 'não'}")
+    print(f"Compressão: {'gzip' if args.compress else 'não'}")
+    print(f"Clientes lentos: {args.slow_clients or 'não'}")
     print("=" * 80)
     
     # Arquivo de resultados
@@ -258,8 +485,35 @@ def main():
             'num_requests': 200,
             'concurrent': True,
             'concurrency': 20
+        },
+        {
+            'name': f'Teste 11: Download Segmentado (10MB) - 10 downloads em {args.segments} conexões paralelas (Range)',
+            'endpoint': '/xlarge.txt',
+            'num_requests': 10,
+            'concurrent': False,
+            'segments': args.segments
+        },
+        {
+            'name': 'Teste 12: Revalidação (If-None-Match) - Arquivo Grande - 100 requisições concorrentes (10 threads)',
+            'endpoint': '/large.txt',
+            'num_requests': 100,
+            'concurrent': True,
+            'concurrency': 10,
+            'revalidate': True
         }
     ]
+    if args.slow_clients:
+        # Mesma carga do Teste 4 com clientes lentos prendendo conexões: a vazão
+        # dos clientes normais só se mantém enquanto os lentos forem menos que
+        # os workers do servidor; acima disso surgem falhas e 503
+        test_scenarios.append({
+            'name': f'Teste 13: Arquivo Pequeno - 100 requisições concorrentes (10 threads) com {args.slow_clients} clientes lentos',
+            'endpoint': '/small.txt',
+            'num_requests': 100,
+            'concurrent': True,
+            'concurrency': 10,
+            'slow_clients': args.slow_clients
+        })
     
     # Executar testes
     for scenario in test_scenarios:
@@ -269,9 +523,24 @@ def main():
         server_results = {}
         
         for server_name, (host, port) in SERVERS.items():
-            tester = LoadTester(server_name, host, port)
+            tester = LoadTester(server_name, host, port, args.keepalive, args.compress)
+            slow_clients = None
+            if scenario.get('slow_clients'):
+                slow_clients = SlowClients(host, port, scenario['slow_clients'])
+                slow_clients.start()
+                # Dá tempo para os clientes lentos ocuparem suas conexões
+                time.sleep(1)
+            if scenario.get('revalidate'):
+                # Cliente com o conteúdo já em cache: só revalida
+                tester.extra_headers.update(tester.prime_validators(scenario['endpoint']))
             
-            if scenario['concurrent']:
+            if scenario.get('segments'):
+                results = tester.run_segmented_test(
+                    scenario['endpoint'],
+                    scenario['num_requests'],
+                    scenario['segments']
+                )
+            elif scenario['concurrent']:
                 results = tester.run_concurrent_test(
                     scenario['endpoint'],
                     scenario['num_requests'],
@@ -284,6 +553,12 @@ def main():
                 )
             
             stats = tester.calculate_statistics(results)
+            if slow_clients is not None:
+                slow_clients.stop()
+                stats['slow_clients'] = slow_clients.count
+                stats['slow_disconnects'] = slow_clients.disconnects
+                # Recusas por sobrecarga dos clientes normais (admissão do nginx)
+                stats['overloaded'] = sum(1 for r in results if r['status_code'] == 503)
             server_results[server_name] = stats
         
         # Salvar resultados
@@ -1,254 +1,3003 @@
 
 import http.server
+import http.client
 import socketserver
+import socket
+import asyncio
+import io
 import os
-from urllib.parse import urlparse
+import errno
+import fcntl
+import selectors
+import mmap
+import struct
+import sys
+import signal
+import posixpath
+import stat
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse, unquote, parse_qs
 import json
+import re
+import queue
+import atexit
+import tempfile
+import shutil
+import hashlib
+import hmac
+import tracemalloc
+import traceback
+import gzip
+import zlib
 from datetime import datetime
 import time
+import bisect
+import heapq
 import resource
+import threading
+import argparse
+from collections import OrderedDict, deque, Counter
+from concurrent.futures import ThreadPoolExecutor
 
-PORT = 80
+# Configuração (variáveis de ambiente, podem ser sobrescritas pela linha de comando)
+PORT = int(os.environ.get('SERVER_PORT', '80'))
+HTML_DIR = os.environ.get('SERVER_HTML_DIR', '/app/html')
+# Modelo de concorrência: 'single' (uma conexão por vez), 'threads' (pool limitado)
+# ou 'async' (um único event loop asyncio multiplexando todas as conexões)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threads')
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '16'))
+# Keep-alive HTTP/1.1: ociosidade máxima (s) e requisições por conexão
+KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '15'))
+KEEPALIVE_REQUESTS = int(os.environ.get('SERVER_KEEPALIVE_REQUESTS', '1000'))
+# Clientes lentos: prazo total (s) para receber o cabeçalho da requisição e
+# inatividade máxima (s) no envio da resposta; a ociosidade entre requisições
+# continua limitada por SERVER_KEEPALIVE_TIMEOUT
+HEADER_TIMEOUT = float(os.environ.get('SERVER_HEADER_TIMEOUT', '10'))
+SEND_TIMEOUT = float(os.environ.get('SERVER_SEND_TIMEOUT', '30'))
+TIMEOUT_KINDS = ('header', 'send', 'keepalive')
+# Cache de conteúdo: orçamento total em bytes e tamanho máximo admitido por arquivo
+CACHE_MAX_BYTES = int(os.environ.get('SERVER_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_MAX_ENTRY_BYTES = int(os.environ.get('SERVER_CACHE_MAX_ENTRY_BYTES', str(2 * 1024 * 1024)))
+# Máximo de intervalos num único cabeçalho Range (acima disso envia o arquivo inteiro)
+MAX_RANGES = int(os.environ.get('SERVER_MAX_RANGES', '16'))
+# Compressão gzip/deflate: faixa de tamanhos comprimidos, nível e orçamento
+# em bytes do cache de variantes comprimidas dos arquivos estáticos
+GZIP_MIN_LENGTH = int(os.environ.get('SERVER_GZIP_MIN_LENGTH', '256'))
+GZIP_MAX_LENGTH = int(os.environ.get('SERVER_GZIP_MAX_LENGTH', str(64 * 1024 * 1024)))
+GZIP_LEVEL = int(os.environ.get('SERVER_GZIP_LEVEL', '6'))
+GZIP_CACHE_MAX_BYTES = int(os.environ.get('SERVER_GZIP_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+# Open file cache: máximo de entradas, validade (s) e cache de erros 404
+OPEN_FILE_CACHE_MAX = int(os.environ.get('SERVER_OPEN_FILE_CACHE_MAX', '1000'))
+OPEN_FILE_CACHE_VALID = float(os.environ.get('SERVER_OPEN_FILE_CACHE_VALID', '10'))
+OPEN_FILE_CACHE_ERRORS = os.environ.get('SERVER_OPEN_FILE_CACHE_ERRORS', '1') == '1'
+# /metrics: intervalo mínimo (s) entre renderizações; scrapes dentro da janela
+# recebem o mesmo corpo pronto (0 renderiza a cada scrape)
+METRICS_CACHE_SECONDS = float(os.environ.get('SERVER_METRICS_CACHE_SECONDS', '1'))
+# Microcache das rotas dinâmicas (/api/status, páginas de status): validade (s)
+# de uma resposta (0 desativa) e número máximo de variantes guardadas
+MICRO_CACHE_TTL = float(os.environ.get('SERVER_MICRO_CACHE_TTL', '0.1'))
+MICRO_CACHE_MAX_ENTRIES = int(os.environ.get('SERVER_MICRO_CACHE_MAX_ENTRIES', '1000'))
+# Agregação entre processos: diretório dos shards de métricas (um arquivo
+# mapeado por processo; vazio = diretório temporário criado pelo mestre) e
+# intervalo (s) em que cada processo publica o próprio shard
+METRICS_DIR = os.environ.get('SERVER_METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('SERVER_METRICS_FLUSH_INTERVAL', '1'))
+# Contagem por caminho: quantos caminhos são acompanhados (top-K) e até quantos
+# caracteres de cada um são guardados; o resto da contagem vai para "other"
+TOP_PATHS = int(os.environ.get('SERVER_TOP_PATHS', '100'))
+TOP_PATHS_MAX_LENGTH = int(os.environ.get('SERVER_TOP_PATHS_MAX_LENGTH', '256'))
+# Requisições lentas: tamanho do anel (0 desativa), limiar (s), quantas das
+# piores de cada janela entram mesmo abaixo do limiar e duração da janela (s)
+SLOW_REQUESTS = int(os.environ.get('SERVER_SLOW_REQUESTS', '100'))
+SLOW_THRESHOLD = float(os.environ.get('SERVER_SLOW_THRESHOLD', '1'))
+SLOW_WORST = int(os.environ.get('SERVER_SLOW_WORST', '5'))
+SLOW_INTERVAL = float(os.environ.get('SERVER_SLOW_INTERVAL', '60'))
+# Fila de conexões completadas no kernel (listen backlog), limitada por net.core.somaxconn
+BACKLOG = int(os.environ.get('SERVER_BACKLOG', '511'))
+# Opções de socket: SO_REUSEPORT (vários processos independentes na mesma porta,
+# balanceados pelo kernel), TCP_NODELAY, SO_SNDBUF em bytes (0 = autoajuste do
+# kernel) e TCP_DEFER_ACCEPT em s (o accept só acorda quando chegam dados).
+# Padrões do nginx: tcp_nodelay ligado, sem deferred accept nem reuseport
+REUSEPORT = os.environ.get('SERVER_REUSEPORT', '0') == '1'
+TCP_NODELAY = os.environ.get('SERVER_TCP_NODELAY', '1') == '1'
+SNDBUF = int(os.environ.get('SERVER_SNDBUF', '0'))
+DEFER_ACCEPT = int(os.environ.get('SERVER_DEFER_ACCEPT', '0'))
+# Controle de admissão: requisições simultâneas no motor async (no modo threads
+# o limite é o tamanho do pool), fila de espera além do limite, espera máxima
+# (s) nessa fila e o Retry-After (s) das respostas 503 de sobrecarga
+MAX_INFLIGHT = int(os.environ.get('SERVER_MAX_INFLIGHT', '256'))
+ADMISSION_QUEUE = int(os.environ.get('SERVER_ADMISSION_QUEUE', '128'))
+ADMISSION_TIMEOUT = float(os.environ.get('SERVER_ADMISSION_TIMEOUT', '2'))
+RETRY_AFTER = int(os.environ.get('SERVER_RETRY_AFTER', '1'))
+# Modo threads: conexão keep-alive ociosa há mais que isso (s) cede a thread a
+# quem está na fila de admissão (abaixo disso o cliente pode já estar enviando)
+ADMISSION_IDLE_GRACE = 0.5
+# Reinicialização graciosa (SIGHUP): tempo máximo (s) para os workers da
+# geração anterior terminarem as conexões em andamento antes de sair
+DRAIN_TIMEOUT = float(os.environ.get('SERVER_DRAIN_TIMEOUT', '30'))
+# Endpoints de depuração (/debug/profile, /debug/tracemalloc, /debug/threads):
+# só existem com um token definido, exigido no cabeçalho X-Debug-Token
+DEBUG_TOKEN = os.environ.get('SERVER_DEBUG_TOKEN', '')
+# Intervalo (s) entre amostras de CPU/memória do processo
+SAMPLE_INTERVAL = float(os.environ.get('SERVER_SAMPLE_INTERVAL', '1'))
+# Log de acesso: destino ('-' = stdout, caminho de arquivo ou 'off'), formato
+# no estilo log_format do nginx, tamanho da fila, linhas por lote, intervalo
+# máximo (s) entre escritas e rotas que não são logadas (separadas por vírgula)
+ACCESS_LOG = os.environ.get('SERVER_ACCESS_LOG', '-')
+ACCESS_LOG_FORMAT = os.environ.get('SERVER_ACCESS_LOG_FORMAT',
+    '$remote_addr - - [$time_local] "$request" $status $body_bytes_sent '
+    '"$http_referer" "$http_user_agent" "$http_x_custom_id" $request_time')
+ACCESS_LOG_BUFFER = int(os.environ.get('SERVER_ACCESS_LOG_BUFFER', '10000'))
+ACCESS_LOG_BATCH = int(os.environ.get('SERVER_ACCESS_LOG_BATCH', '256'))
+ACCESS_LOG_FLUSH = float(os.environ.get('SERVER_ACCESS_LOG_FLUSH', '1'))
+ACCESS_LOG_SKIP = [route for route in os.environ.get('SERVER_ACCESS_LOG_SKIP', '/metrics').split(',') if route]
+
+# Erros do os.sendfile que indicam "não suportado aqui" (usa a cópia em buffer)
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+COPY_BUFSIZE = 64 * 1024
+# Maior corpo de requisição descartado para manter a conexão aberta
+BODY_DISCARD_MAX = 64 * 1024
+# Motor asyncio: o sendfile sai em blocos e cada um precisa terminar em SEND_TIMEOUT
+ASYNC_SENDFILE_CHUNK = 1024 * 1024
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Limites (s) dos buckets dos histogramas de latência; as fases (parse,
+# roteamento, open) ficam na casa dos microssegundos e usam buckets mais finos
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PHASE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025) + LATENCY_BUCKETS
+
+class Histogram:
+    """Histograma de buckets fixos; observe() é O(1) (busca em ~20 limites)."""
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'exemplars')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # Por bucket, (rótulos, valor, instante) de uma observação de exemplo
+        self.exemplars = None
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def copy(self):
+        histogram = Histogram(self.bounds)
+        histogram.counts = list(self.counts)
+        histogram.sum, histogram.count = self.sum, self.count
+        return histogram
+
+class TopPaths:
+    """Caminhos mais requisitados com memória limitada (algoritmo Space-Saving).
+
+    Acompanha no máximo `capacity` caminhos. Um caminho novo com a tabela
+    cheia toma o lugar do menos contado e herda a contagem dele como erro
+    máximo, então count - error é um mínimo garantido (exato para quem nunca
+    trocou de lugar). Os caminhos ficam agrupados por contagem, o que deixa
+    incremento e troca do mínimo em O(1). Cada entrada guarda também a
+    latência (soma, máximo e amostras) desde que entrou na tabela.
+    """
+    def __init__(self, capacity, max_length):
+        self.capacity = capacity
+        self.max_length = max_length
+        # caminho -> [count, error, latency_sum, latency_max, observed]
+        self.entries = {}
+        # count -> caminhos com essa contagem
+        self.buckets = {}
+        self.min_count = 0
+        self.total = 0
+    
+    def add(self, path, latency):
+        self.total += 1
+        if self.capacity <= 0:
+            return
+        path = path[:self.max_length]
+        entry = self.entries.get(path)
+        if entry is None:
+            if len(self.entries) < self.capacity:
+                count = self.min_count = 0
+            else:
+                count = self.min_count
+                victims = self.buckets[count]
+                del self.entries[victims.pop()]
+            entry = self.entries[path] = [count, count, 0.0, 0.0, 0]
+            self.buckets.setdefault(count, set()).add(path)
+        
+        count = entry[0]
+        bucket = self.buckets[count]
+        bucket.discard(path)
+        if not bucket:
+            del self.buckets[count]
+            if count == self.min_count:
+                self.min_count = count + 1
+        self.buckets.setdefault(count + 1, set()).add(path)
+        entry[0] = count + 1
+        entry[2] += latency
+        entry[3] = max(entry[3], latency)
+        entry[4] += 1
+    
+    def export(self):
+        """[(caminho, requisições garantidas, soma e máximo da latência, amostras)],
+        sem ordem: os shards juntam as tabelas de todos os processos."""
+        return [(path, count - error, latency_sum, latency_max, observed)
+                for path, (count, error, latency_sum, latency_max, observed) in self.entries.items()]
+
+def label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Scrape:
+    """Valores lidos uma única vez por renderização do /metrics."""
+    __slots__ = ('uptime', 'top_paths', 'totals', 'shards', 'slow')
+
+    def __init__(self):
+        self.uptime = time.time() - metrics.start_time
+        self.totals, self.shards = shards.aggregate()
+        self.top_paths = shards.top_paths()
+        self.slow = shards.slow_entries(refresh=False)
+
+class MetricFamily:
+    """Família registrada, com HELP/TYPE e prefixos das amostras já em bytes.
+
+    `collect(scrape)` devolve o valor da amostra única ou, se `labeled`,
+    pares (rótulos, valor); em histogramas o valor é um Histogram.
+    """
+    __slots__ = ('name', 'kind', 'collect', 'fmt', 'labeled', 'header', 'om_header',
+                 'prefix', 'labels', 'extra_labels', 'prefixes', 'buckets')
+
+    def __init__(self, base_labels, name, kind, help_text, collect, fmt, labels, labeled, buckets):
+        self.name = name
+        self.buckets = buckets
+        self.kind = kind
+        self.collect = collect
+        self.fmt = fmt
+        self.labeled = labeled
+        self.extra_labels = labels
+        self.header = f'# HELP {name} {help_text}\n# TYPE {name} {kind}\n'.encode()
+        # OpenMetrics: a família do contador não leva o sufixo _total (só as
+        # amostras); contadores sem o sufixo são expostos como "unknown"
+        om_name, om_kind = name, kind
+        if kind == 'counter':
+            if name.endswith('_total'):
+                om_name = name[:-len('_total')]
+            else:
+                om_kind = 'unknown'
+        self.om_header = f'# HELP {om_name} {help_text}\n# TYPE {om_name} {om_kind}\n'.encode()
+        self.relabel(base_labels)
+    
+    def relabel(self, base_labels):
+        """Troca os rótulos comuns (servidor, geração) e refaz os prefixos."""
+        self.labels = base_labels + (f',{self.extra_labels}' if self.extra_labels else '')
+        self.prefix = f'{self.name}{{{self.labels}}} '.encode()
+        self.prefixes = {}
+
+    def sample_prefixes(self, labels):
+        """Prefixos em bytes das amostras de um conjunto de rótulos (memorizados)."""
+        prefixes = self.prefixes.get(labels)
+        if prefixes is None:
+            base = f'{self.labels},{labels}' if labels else self.labels
+            if self.kind == 'histogram':
+                buckets = [f'{self.name}_bucket{{{base},le="{bound}"}} '.encode() for bound in self.buckets]
+                buckets.append(f'{self.name}_bucket{{{base},le="+Inf"}} '.encode())
+                prefixes = (buckets, f'{self.name}_sum{{{base}}} '.encode(),
+                            f'{self.name}_count{{{base}}} '.encode())
+            else:
+                prefixes = f'{self.name}{{{base}}} '.encode()
+            self.prefixes[labels] = prefixes
+        return prefixes
+
+    def value(self, value):
+        if self.fmt is None:
+            return str(value).encode()
+        return format(value, self.fmt).encode()
+
+    def render(self, scrape, out, openmetrics):
+        out.append(self.om_header if openmetrics else self.header)
+        if not self.labeled:
+            out += (self.prefix, self.value(self.collect(scrape)), b'\n')
+            return
+        for labels, value in self.collect(scrape):
+            prefixes = self.sample_prefixes(labels)
+            if self.kind != 'histogram':
+                out += (prefixes, self.value(value), b'\n')
+                continue
+            buckets, sum_prefix, count_prefix = prefixes
+            # Exemplars só existem no formato OpenMetrics
+            exemplars = value.exemplars if openmetrics else None
+            cumulative = 0
+            for index, (prefix, count) in enumerate(zip(buckets, value.counts)):
+                cumulative += count
+                out += (prefix, str(cumulative).encode())
+                if exemplars and exemplars[index]:
+                    labels, observed, timestamp = exemplars[index]
+                    out.append(f' # {{{labels}}} {observed:.6f} {timestamp:.3f}'.encode())
+                out.append(b'\n')
+            out += (sum_prefix, format(value.sum, '.6f').encode(), b'\n',
+                    count_prefix, str(value.count).encode(), b'\n')
+
+class MetricsRegistry:
+    """Registro das famílias expostas em /metrics.
+
+    Nomes, HELP/TYPE e rótulos viram bytes no registro; uma renderização só
+    formata os valores. O corpo pronto (e suas variantes comprimidas) é
+    reaproveitado por METRICS_CACHE_SECONDS, então vários Prometheus/Grafana
+    raspando ao mesmo tempo custam uma renderização por janela. Toda amostra
+    leva os rótulos server e generation (geração de workers, ver SIGHUP).
+    """
+    def __init__(self, server, cache_seconds):
+        self.server = server
+        self.generation = 1
+        self.cache_seconds = cache_seconds
+        self.families = []
+        # formato (openmetrics?) -> (mtime do arquivo, corpo, {codificação: corpo comprimido})
+        self.cache = {}
+        self.renders = 0
+        self.cache_hits = 0
+        self.render_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def register(self, name, kind, help_text, collect, fmt=None, labels='', labeled=False, buckets=LATENCY_BUCKETS):
+        self.families.append(MetricFamily(self.base_labels(), name, kind, help_text, collect, fmt, labels, labeled, buckets))
+    
+    def base_labels(self):
+        return f'server="{self.server}",generation="{self.generation}"'
+    
+    def set_generation(self, generation):
+        with self.lock:
+            self.generation = generation
+            for family in self.families:
+                family.relabel(self.base_labels())
+            self.cache.clear()
+
+    def counter(self, name, help_text, collect, fmt=None, labels=''):
+        self.register(name, 'counter', help_text, collect, fmt, labels)
+
+    def gauge(self, name, help_text, collect, fmt=None, labels=''):
+        self.register(name, 'gauge', help_text, collect, fmt, labels)
+
+    def render(self, openmetrics=False):
+        scrape = Scrape()
+        out = []
+        for family in self.families:
+            family.render(scrape, out, openmetrics)
+        if openmetrics:
+            out.append(b'# EOF\n')
+        return b''.join(out)
+
+    def exposition(self, openmetrics, encoding):
+        """Corpo do /metrics no formato e codificação pedidos, do cache quando fresco.
+
+        O corpo fica num arquivo no diretório dos shards, comum a todos os
+        processos: o worker que responde serve a última renderização de
+        qualquer um deles, então um contador nunca volta para trás entre dois
+        scrapes. A renderização acontece sob o lock e um flock no arquivo:
+        scrapes simultâneos com o cache vencido esperam a mesma renderização
+        em vez de repeti-la.
+        """
+        path = os.path.join(shards.directory, f'exposition-{self.generation}-{int(openmetrics)}')
+        with self.lock, open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                stamp = os.stat(path).st_mtime
+            except FileNotFoundError:
+                stamp = 0.0
+            cached = self.cache.get(openmetrics)
+            if time.time() - stamp < self.cache_seconds:
+                self.cache_hits += 1
+                if cached is None or cached[0] != stamp:
+                    with open(path, 'rb') as f:
+                        cached = self.cache[openmetrics] = (stamp, f.read(), {})
+            else:
+                start = time.perf_counter()
+                body = self.render(openmetrics)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(body)
+                os.replace(path + '.tmp', path)
+                cached = self.cache[openmetrics] = (os.stat(path).st_mtime, body, {})
+                self.renders += 1
+                self.render_seconds += time.perf_counter() - start
+            _, body, variants = cached
+            if encoding is None:
+                return body
+            compressed = variants.get(encoding)
+            if compressed is None:
+                compressed = variants[encoding] = compress(body, encoding)
+            return compressed
 
 # Contadores para métricas
 class Metrics:
+    # Contadores somados entre processos no /metrics (ver MetricShards)
+    SHARED = ('requests_total', 'requests_2xx', 'requests_3xx', 'requests_4xx', 'requests_5xx',
+              'bytes_sent', 'sendfile_bytes', 'buffered_bytes', 'memory_bytes', 'compression_in_bytes',
+              'compression_out_bytes', 'compression_cpu_seconds', 'timeouts_header', 'timeouts_send',
+              'timeouts_keepalive')
+
     def __init__(self):
         self.requests_total = 0
         self.bytes_sent = 0
         self.start_time = time.time()
         self.requests_2xx = 0
+        self.requests_3xx = 0
         self.requests_4xx = 0
         self.requests_5xx = 0
-        self.requests_by_path = {}
+        self.top_paths = TopPaths(TOP_PATHS, TOP_PATHS_MAX_LENGTH)
         self.total_request_time = 0.0
-        self.request_times = []
-        # Métricas específicas do Nginx
-        self.cache_hits = 0
-        self.cache_misses = 0
-        self.cache_size = 0
-        # Métricas em comum
-        self.last_cpu_time = 0.0
-        self.last_memory = 0
-    
-    def increment_request(self, status_code=200, path='/', request_time=0.01):
-        self.requests_total += 1
-        if 200 <= status_code < 300:
-            self.requests_2xx += 1
-            # Simular cache hits para arquivos estáticos
-            if path.endswith(('.txt', '.html', '.js', '.css')):
-                if self.requests_total % 3 == 0:  # 33% cache hit rate
-                    self.cache_hits += 1
-                else:
-                    self.cache_misses += 1
-        elif 400 <= status_code < 500:
-            self.requests_4xx += 1
-        elif 500 <= status_code < 600:
-            self.requests_5xx += 1
+        # Janela das últimas 1000 latências com soma corrente (média em O(1))
+        self.request_times = deque(maxlen=1000)
+        self.request_times_sum = 0.0
+        # Histogramas por (rota, classe de status) e por (rota, fase)
+        self.latency = {}
+        self.phases = {}
+        # Bytes de arquivos estáticos enviados por sendfile vs. cópia em buffer
+        self.sendfile_bytes = 0
+        self.buffered_bytes = 0
+        # Bytes de arquivos estáticos servidos da memória (cache de conteúdo,
+        # variantes comprimidas): nem sendfile nem cópia do arquivo
+        self.memory_bytes = 0
+        # Compressão: bytes de entrada/saída e CPU gasta comprimindo
+        self.compression_in_bytes = 0
+        self.compression_out_bytes = 0
+        self.compression_cpu_seconds = 0.0
+        # Conexões encerradas por timeout, por tipo (ver TIMEOUT_KINDS)
+        self.timeouts_header = 0
+        self.timeouts_send = 0
+        self.timeouts_keepalive = 0
+        self.lock = threading.Lock()
+    
+    def increment_request(self, status_code=200, path='/', request_time=0.01, route=None, phases=()):
+        with self.lock:
+            self.requests_total += 1
+            if 200 <= status_code < 300:
+                self.requests_2xx += 1
+            elif 300 <= status_code < 400:
+                self.requests_3xx += 1
+            elif 400 <= status_code < 500:
+                self.requests_4xx += 1
+            elif 500 <= status_code < 600:
+                self.requests_5xx += 1
         
-        self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
-        self.total_request_time += request_time
-        self.request_times.append(request_time)
-        if len(self.request_times) > 1000:
-            self.request_times.pop(0)
+            self.top_paths.add(path, request_time)
+            self.total_request_time += request_time
+            if len(self.request_times) == self.request_times.maxlen:
+                self.request_times_sum -= self.request_times[0]
+            self.request_times.append(request_time)
+            self.request_times_sum += request_time
+            
+            key = (route or path, f'{status_code // 100}xx')
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(request_time)
+            for phase, seconds in phases:
+                histogram = self.phases.get((route, phase))
+                if histogram is None:
+                    histogram = self.phases[(route, phase)] = Histogram(PHASE_BUCKETS)
+                histogram.observe(seconds)
     
     def add_bytes(self, bytes_count):
-        self.bytes_sent += bytes_count
-        self.cache_size = min(self.bytes_sent, 10485760)  # Máximo de 10MB de cache
+        with self.lock:
+            self.bytes_sent += bytes_count
     
-    def get_avg_response_time(self):
-        if not self.request_times:
-            return 0.0
-        return sum(self.request_times) / len(self.request_times)
+    def add_static_transfer(self, zero_copy, buffered, memory=0):
+        with self.lock:
+            self.sendfile_bytes += zero_copy
+            self.buffered_bytes += buffered
+            self.memory_bytes += memory
     
-    def get_cpu_usage(self):
-        return resource.getrusage(resource.RUSAGE_SELF).ru_utime + resource.getrusage(resource.RUSAGE_SELF).ru_stime
+    def add_compression(self, in_bytes, out_bytes, cpu_seconds):
+        with self.lock:
+            self.compression_in_bytes += in_bytes
+            self.compression_out_bytes += out_bytes
+            self.compression_cpu_seconds += cpu_seconds
     
-    def get_memory_usage(self):
-        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    def add_timeout(self, kind):
+        name = f'timeouts_{kind}'
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
     
-    def get_error_rate(self):
-        if self.requests_total == 0:
-            return 0.0
-        return ((self.requests_4xx + self.requests_5xx) / self.requests_total) * 100
+    def top_paths_export(self):
+        with self.lock:
+            return {'total': self.top_paths.total, 'paths': self.top_paths.export()}
     
-    def get_success_rate(self):
-        if self.requests_total == 0:
-            return 0.0
-        return (self.requests_2xx / self.requests_total) * 100
+    def shard_values(self):
+        """Estado a publicar no shard do processo: pares (chave, valores)."""
+        with self.lock:
+            values = [((name,), [getattr(self, name)]) for name in self.SHARED]
+            # Janela das últimas latências do processo (média somada entre os vivos)
+            values.append((('live', 'request_window_seconds'), [max(self.request_times_sum, 0.0)]))
+            values.append((('live', 'request_window_count'), [len(self.request_times)]))
+            for kind, histograms in (('latency', self.latency), ('phase', self.phases)):
+                values.extend(((kind,) + key, histogram.counts + [histogram.sum, histogram.count])
+                              for key, histogram in histograms.items())
+        return values
 
 metrics = Metrics()
 
-class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def do_GET(self):
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
-        request_start = time.time()
-        
-        # Log do X-Custom-ID
-        x_custom_id = self.headers.get('X-Custom-ID', 'N/A')
-        print(f"[{datetime.now().isoformat()}] {self.command} {path} - X-Custom-ID: {x_custom_id}")
-        
-        # Endpoint de métricas Prometheus
-        if path == '/metrics':
-            request_time = time.time() - request_start
-            metrics.increment_request(200, path, request_time)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; version=0.0.4')
-            self.end_headers()
-            uptime = time.time() - metrics.start_time
-            prometheus_metrics = f"""# HELP http_requests_total Total HTTP requests
-# TYPE http_requests_total counter
-http_requests_total{{server="nginx",aluno="Hermeson_A",matricula="20239035382"}} {metrics.requests_total}
-
-# HELP http_response_size_bytes Total bytes sent
-# TYPE http_response_size_bytes counter
-http_response_size_bytes{{server="nginx"}} {metrics.bytes_sent}
-
-# HELP http_connections_active Active connections
-# TYPE http_connections_active gauge
-http_connections_active{{server="nginx"}} 1
-
-# HELP process_uptime_seconds Server uptime in seconds
-# TYPE process_uptime_seconds counter
-process_uptime_seconds{{server="nginx"}} {uptime:.2f}
-
-# HELP process_cpu_seconds_total Total user and system CPU time spent in seconds
-# TYPE process_cpu_seconds_total counter
-process_cpu_seconds_total{{server="nginx"}} {resource.getrusage(resource.RUSAGE_SELF).ru_utime + resource.getrusage(resource.RUSAGE_SELF).ru_stime:.2f}
-
-# HELP process_resident_memory_bytes Resident memory size in bytes
-# TYPE process_resident_memory_bytes gauge
-process_resident_memory_bytes{{server="nginx"}} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
-
-# HELP http_requests_2xx HTTP requests with 2xx status
-# TYPE http_requests_2xx counter
-http_requests_2xx{{server="nginx"}} {metrics.requests_2xx}
-
-# HELP http_requests_4xx HTTP requests with 4xx status
-# TYPE http_requests_4xx counter
-http_requests_4xx{{server="nginx"}} {metrics.requests_4xx}
-
-# HELP http_requests_5xx HTTP requests with 5xx status
-# TYPE http_requests_5xx counter
-http_requests_5xx{{server="nginx"}} {metrics.requests_5xx}
-
-# HELP http_request_duration_seconds Average request duration
-# TYPE http_request_duration_seconds gauge
-http_request_duration_seconds{{server="nginx"}} {metrics.get_avg_response_time():.4f}
-
-# HELP http_requests_per_second Requests per second
-# TYPE http_requests_per_second gauge
-http_requests_per_second{{server="nginx"}} {metrics.requests_total / max(uptime, 0.001):.2f}
-
-# HELP http_bytes_per_second Bytes sent per second
-# TYPE http_bytes_per_second gauge
-http_bytes_per_second{{server="nginx"}} {metrics.bytes_sent / max(uptime, 0.001):.2f}
-
-# HELP nginx_cache_hits Cache hits
-# TYPE nginx_cache_hits counter
-nginx_cache_hits{{server="nginx"}} {metrics.cache_hits}
-
-# HELP nginx_cache_misses Cache misses
-# TYPE nginx_cache_misses counter
-nginx_cache_misses{{server="nginx"}} {metrics.cache_misses}
-
-# HELP nginx_cache_size Current cache size in bytes
-# TYPE nginx_cache_size gauge
-nginx_cache_size{{server="nginx"}} {metrics.cache_size}
-
-# HELP nginx_cache_hit_rate Cache hit rate percentage
-# TYPE nginx_cache_hit_rate gauge
-nginx_cache_hit_rate{{server="nginx"}} {(metrics.cache_hits / max(metrics.cache_hits + metrics.cache_misses, 1) * 100):.2f}
-
-# HELP http_success_rate HTTP success rate percentage (2xx)
-# TYPE http_success_rate gauge
-http_success_rate{{server="nginx"}} {metrics.get_success_rate():.2f}
-
-# HELP http_error_rate HTTP error rate percentage (4xx + 5xx)
-# TYPE http_error_rate gauge
-http_error_rate{{server="nginx"}} {metrics.get_error_rate():.2f}
-
-# HELP system_cpu_percent_usage Current CPU usage percentage
-# TYPE system_cpu_percent_usage gauge
-system_cpu_percent_usage{{server="nginx"}} {(metrics.get_cpu_usage() % 100):.2f}
-
-# HELP system_memory_usage_bytes Current memory usage in bytes
-# TYPE system_memory_usage_bytes gauge
-system_memory_usage_bytes{{server="nginx"}} {metrics.get_memory_usage()}
-
-# HELP system_memory_usage_percent Memory usage percentage
-# TYPE system_memory_usage_percent gauge
-system_memory_usage_percent{{server="nginx"}} {(metrics.get_memory_usage() / 1073741824 * 100):.2f}
-"""
-            response_data = prometheus_metrics.encode()
-            metrics.add_bytes(len(response_data))
-            self.wfile.write(response_data)
+class MetricShards:
+    """Contadores e histogramas de vários processos somados no /metrics.
+
+    Cada processo que atende publica o próprio estado num arquivo mapeado
+    em memória (o shard) dentro de `directory`; quem responde o /metrics lê
+    e soma todos. A publicação copia os valores locais a cada `interval` s
+    numa thread própria e antes de cada renderização, fora do caminho da
+    requisição, e só o dono escreve no shard: não há trava entre processos.
+    Uma entrada nova é escrita por inteiro antes de o cabeçalho (bytes em
+    uso) avançar, então o leitor nunca vê entrada pela metade. O top-K de
+    caminhos e o anel de requisições lentas vão em JSONs ao lado.
+
+    O dono segura um flock exclusivo no próprio shard enquanto vive (o
+    kernel o solta quando o processo morre, mesmo com SIGKILL, e um PID
+    reaproveitado não engana). As entradas ('live', nome) são medidas do
+    momento (conexões por estado, RSS, entradas de cache) e só somam de
+    shards com dono vivo. Quando um worker sai, o mestre soma os contadores
+    e histogramas dele ao shard aposentado e apaga os arquivos (ver retire):
+    os contadores não voltam para trás e o diretório não cresce.
+    """
+    HEADER = struct.Struct('=Q')
+    # Tamanho da chave (JSON) e número de valores double da entrada
+    ENTRY = struct.Struct('=HH')
+    INITIAL_SIZE = 64 * 1024
+    # Nome dos arquivos com o que os processos que já saíram acumularam
+    RETIRED = 'retired'
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.file = None
+        self.mm = None
+        self.offsets = {}
+        self.used = self.HEADER.size
+        self.slow_path = None
+        self.slow_version = 0
+        self.top_path = None
+        self.top_total = -1
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+    
+    def setup(self):
+        """No mestre, antes do fork: prepara o diretório compartilhado e
+        aposenta shards que uma execução anterior tenha deixado nele."""
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.retire()
+        else:
+            self.directory = tempfile.mkdtemp(prefix='metrics-')
+            atexit.register(shutil.rmtree, self.directory, True)
+    
+    def start(self):
+        """Cria o shard do processo atual e a thread de publicação."""
+        name = f'{os.getpid()}-{os.urandom(4).hex()}'
+        # Travado antes de ganhar o nome final: retire nunca vê o shard sem dono
+        path = os.path.join(self.directory, f'shard-{name}.db')
+        self.file = open(path + '.new', 'w+b')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        os.rename(path + '.new', path)
+        self.slow_path = os.path.join(self.directory, f'slow-{name}.json')
+        self.top_path = os.path.join(self.directory, f'top-{name}.json')
+        self.file.truncate(self.INITIAL_SIZE)
+        self.mm = mmap.mmap(self.file.fileno(), self.INITIAL_SIZE)
+        self.HEADER.pack_into(self.mm, 0, self.used)
+        threading.Thread(target=self.run, name='metric-shard', daemon=True).start()
+        atexit.register(self.close)
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.publish()
+    
+    def close(self):
+        """Última publicação antes de o processo sair."""
+        if self.mm is not None:
+            self.stopped.set()
+            self.publish()
+    
+    def publish(self):
+        values = metrics.shard_values() + process_shard_values()
+        slow_requests.tick()
+        with self.lock:
+            for key, data in values:
+                offset = self.offsets.get(key)
+                if offset is None:
+                    offset = self.append(key, len(data))
+                struct.pack_into(f'={len(data)}d', self.mm, offset, *data)
+            self.HEADER.pack_into(self.mm, 0, self.used)
+            # O anel de requisições lentas e o top-K vão em JSONs ao lado, trocados inteiros
+            if slow_requests.version != self.slow_version:
+                self.slow_version = slow_requests.version
+                self.write_json(self.slow_path, slow_requests.export())
+            if metrics.top_paths.total != self.top_total:
+                top_paths = metrics.top_paths_export()
+                self.top_total = top_paths['total']
+                self.write_json(self.top_path, top_paths)
+    
+    def write_json(self, path, data):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+    
+    def append(self, key, count):
+        encoded = json.dumps(key).encode()
+        size = self.ENTRY.size + len(encoded)
+        size += -size % 8
+        end = self.used + size + 8 * count
+        if end > len(self.mm):
+            # resize() aumenta também o arquivo; leitores usam read(), não o mapa
+            self.mm.resize(max(len(self.mm) * 2, end))
+        self.ENTRY.pack_into(self.mm, self.used, len(encoded), count)
+        start = self.used + self.ENTRY.size
+        self.mm[start:start + len(encoded)] = encoded
+        offset = self.offsets[key] = self.used + size
+        self.used = end
+        return offset
+    
+    def pack(self, totals):
+        """Conteúdo de um shard com as entradas {chave: valores} (para o aposentado)."""
+        out = bytearray(self.HEADER.size)
+        for key, values in totals.items():
+            encoded = json.dumps(key).encode()
+            size = self.ENTRY.size + len(encoded)
+            out += self.ENTRY.pack(len(encoded), len(values)) + encoded + bytes(-size % 8)
+            out += struct.pack(f'={len(values)}d', *values)
+        self.HEADER.pack_into(out, 0, len(out))
+        return bytes(out)
+    
+    def entries(self, data):
+        """Pares (chave, valores) de um shard lido do disco."""
+        if len(data) < self.HEADER.size:
             return
-        
-        # Endpoint de status da API
-        if path == '/api/status':
-            request_time = time.time() - request_start
-            metrics.increment_request(200, path, request_time)
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            response = {
-                'status': 'ok',
-                'server': 'python-nginx',
-                'timestamp': datetime.now().isoformat(),
-                'x_custom_id': x_custom_id
-            }
-            response_data = json.dumps(response).encode()
-            metrics.add_bytes(len(response_data))
-            self.wfile.write(response_data)
+        used = min(self.HEADER.unpack_from(data)[0], len(data))
+        offset = self.HEADER.size
+        while offset < used:
+            length, count = self.ENTRY.unpack_from(data, offset)
+            raw = data[offset + self.ENTRY.size:offset + self.ENTRY.size + length]
+            key = self.keys.get(raw)
+            if key is None:
+                key = self.keys[raw] = tuple(json.loads(raw))
+            offset += self.ENTRY.size + length
+            offset += -offset % 8
+            yield key, struct.unpack_from(f'={count}d', data, offset)
+            offset += 8 * count
+    
+    def read_shard(self, name):
+        """(conteúdo, dono vivo?) de um shard; None se sumiu."""
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    alive = True
+                else:
+                    alive = False
+                return f.read(), alive
+        except OSError:
+            return None
+    
+    def locked(self, operation):
+        """Trava do diretório: LOCK_SH para ler os shards, LOCK_EX para aposentá-los.
+
+        A publicação não passa por ela, só leitores e o mestre.
+        """
+        lock = open(os.path.join(self.directory, 'shards.lock'), 'a')
+        fcntl.flock(lock, operation)
+        return lock
+    
+    def aggregate(self):
+        """Soma os shards de todos os processos: ({chave: valores}, nº de shards vivos)."""
+        if self.mm is not None:
+            self.publish()
+        totals = {}
+        shards = 0
+        with self.locked(fcntl.LOCK_SH):
+            for name in os.listdir(self.directory):
+                if not (name.startswith('shard-') and name.endswith('.db')):
+                    continue
+                shard = self.read_shard(name)
+                if shard is None:
+                    continue
+                data, alive = shard
+                shards += alive
+                for key, values in self.entries(data):
+                    if key[0] == 'live' and not alive:
+                        continue
+                    current = totals.get(key)
+                    if current is None:
+                        totals[key] = list(values)
+                    else:
+                        for index, value in enumerate(values):
+                            current[index] += value
+        return totals, shards
+    
+    def retire(self):
+        """Soma os shards de processos que já saíram ao shard aposentado.
+
+        Chamado pelo mestre ao recolher um worker e na partida. Entram os
+        contadores e histogramas (as medidas do momento morrem com o
+        processo), o top-K e o anel de lentas; os arquivos originais são
+        apagados, assim como os corpos do /metrics de outras gerações.
+        """
+        with self.locked(fcntl.LOCK_EX):
+            names = os.listdir(self.directory)
+            retired_shard = f'shard-{self.RETIRED}.db'
+            dead = []
+            totals = {}
+            for name in names:
+                if not (name.startswith('shard-') and name.endswith('.db')):
+                    continue
+                shard = self.read_shard(name)
+                if shard is None or (shard[1] and name != retired_shard):
+                    continue
+                if name != retired_shard:
+                    dead.append(name[len('shard-'):-len('.db')])
+                for key, values in self.entries(shard[0]):
+                    if key[0] == 'live':
+                        continue
+                    current = totals.get(key)
+                    if current is None:
+                        totals[key] = list(values)
+                    else:
+                        for index, value in enumerate(values):
+                            current[index] += value
+            if dead:
+                owners = dead + [self.RETIRED]
+                top_paths = self.merge_top_paths([f'top-{owner}.json' for owner in owners])
+                top_paths['paths'] = sorted(top_paths['paths'], key=lambda row: row[1], reverse=True)[:TOP_PATHS]
+                slow = self.read_slow([f'slow-{owner}.json' for owner in owners])[:slow_requests.entries.maxlen]
+                path = os.path.join(self.directory, retired_shard)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(self.pack(totals))
+                os.replace(path + '.tmp', path)
+                self.write_json(os.path.join(self.directory, f'top-{self.RETIRED}.json'), top_paths)
+                self.write_json(os.path.join(self.directory, f'slow-{self.RETIRED}.json'), slow)
+            for name in names:
+                # Arquivos dos processos aposentados (inclusive .tmp/.new órfãos)
+                # e corpos do /metrics de outras gerações (ou de outra execução)
+                if any(owner in name for owner in dead) or (
+                        name.startswith('exposition-') and int(name.split('-')[1]) != registry.generation):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+    
+    def merge_top_paths(self, names):
+        """Junta tabelas exportadas de top-K no mesmo formato (sem ordem)."""
+        merged = {}
+        total = 0
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            total += data['total']
+            for path, count, latency_sum, latency_max, observed in data['paths']:
+                entry = merged.get(path)
+                if entry is None:
+                    merged[path] = [path, count, latency_sum, latency_max, observed]
+                else:
+                    entry[1] += count
+                    entry[2] += latency_sum
+                    entry[3] = max(entry[3], latency_max)
+                    entry[4] += observed
+        return {'total': total, 'paths': list(merged.values())}
+    
+    def top_paths(self):
+        """Top-K de todos os processos: ([(caminho, requisições garantidas,
+        latência média, máxima)] em ordem decrescente, requisições em "other").
+
+        As contagens garantidas de cada processo somam um mínimo garantido
+        do total; latências somam pelas amostras e o máximo é o maior de todos.
+        """
+        with self.locked(fcntl.LOCK_SH):
+            top_paths = self.merge_top_paths([name for name in os.listdir(self.directory)
+                                              if name.startswith('top-') and name.endswith('.json')])
+        rows = sorted(((path, count, latency_sum / max(observed, 1), latency_max)
+                       for path, count, latency_sum, latency_max, observed in top_paths['paths']),
+                      key=lambda row: row[1], reverse=True)[:TOP_PATHS]
+        return rows, top_paths['total'] - sum(row[1] for row in rows)
+    
+    def read_slow(self, names):
+        entries = []
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    entries.extend(json.load(f))
+            except (OSError, ValueError):
+                continue
+        entries.sort(key=lambda entry: entry['timestamp'], reverse=True)
+        return entries
+    
+    def slow_entries(self, refresh=True):
+        """Requisições lentas de todos os processos, da mais recente à mais antiga."""
+        if refresh and self.mm is not None:
+            self.publish()
+        with self.locked(fcntl.LOCK_SH):
+            return self.read_slow([name for name in os.listdir(self.directory)
+                                   if name.startswith('slow-') and name.endswith('.json')])
+
+shards = MetricShards(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+
+class ConnectionStats:
+    """Ciclo de vida das conexões, nos moldes do stub_status do nginx.
+
+    accepted conta os accept() no socket de escuta e handled as conexões que
+    chegaram a um worker. Cada conexão aberta está em um único estado:
+    reading (lendo a requisição), writing (roteando e enviando a resposta) ou
+    waiting (keep-alive ocioso, à espera da próxima requisição).
+    """
+    STATES = ('reading', 'writing', 'waiting')
+
+    def __init__(self):
+        self.accepted = 0
+        self.handled = 0
+        self.states = dict.fromkeys(self.STATES, 0)
+        self.lock = threading.Lock()
+    
+    def accept(self):
+        with self.lock:
+            self.accepted += 1
+    
+    def open(self):
+        with self.lock:
+            self.handled += 1
+            self.states['waiting'] += 1
+        return 'waiting'
+    
+    def move(self, old, new):
+        """Troca o estado de uma conexão; retorna o novo estado."""
+        if old != new:
+            with self.lock:
+                self.states[old] -= 1
+                self.states[new] += 1
+        return new
+    
+    def close(self, state):
+        with self.lock:
+            self.states[state] -= 1
+    
+    def active(self):
+        return sum(self.states.values())
+    
+    def snapshot(self):
+        with self.lock:
+            return self.accepted, self.handled, dict(self.states)
+
+connections = ConnectionStats()
+
+class SlowRequests:
+    """Anel limitado das requisições lentas, com o X-Custom-ID de cada uma.
+
+    Entra toda requisição acima de `threshold` s e, a cada janela de
+    `interval` s, as `worst` mais lentas da janela mesmo abaixo do limiar
+    (um servidor rápido ainda mostra o seu pior caso). Cada entrada guarda
+    caminho, rota, status, bytes, duração de cada fase e X-Custom-ID; os
+    shards publicam o anel para o /api/slow-requests e para os exemplars do
+    histograma de latência.
+    """
+    def __init__(self, capacity, threshold, worst, interval):
+        self.enabled = capacity > 0
+        self.entries = deque(maxlen=max(capacity, 1))
+        self.threshold = threshold
+        self.worst = worst
+        self.interval = interval
+        # Heap (duração, seq, campos, já no anel?) das piores da janela atual
+        self.window = []
+        self.window_end = time.monotonic() + interval
+        self.seq = 0
+        self.version = 0
+        self.lock = threading.Lock()
+    
+    def offer(self, request_time, *fields):
+        if not self.enabled:
             return
-        
-        # Stub status para métricas
-        if path == '/stub_status':
-            request_time = time.time() - request_start
-            metrics.increment_request(200, path, request_time)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain')
-            self.end_headers()
-            status = f"""Active connections: 1
-server accepts handled requests
- 1 1 1
-Reading: 0 Writing: 1 Waiting: 0
-"""
-            response_data = status.encode()
-            metrics.add_bytes(len(response_data))
-            self.wfile.write(response_data)
+        with self.lock:
+            if time.monotonic() >= self.window_end:
+                self.close_window()
+            added = request_time >= self.threshold
+            if added:
+                self.add(request_time, fields)
+            if self.worst:
+                self.seq += 1
+                item = (request_time, self.seq, fields, added)
+                if len(self.window) < self.worst:
+                    heapq.heappush(self.window, item)
+                elif request_time > self.window[0][0]:
+                    heapq.heapreplace(self.window, item)
+    
+    def add(self, request_time, fields):
+        self.entries.append((request_time, fields))
+        self.version += 1
+    
+    def close_window(self):
+        for request_time, _, fields, added in self.window:
+            if not added:
+                self.add(request_time, fields)
+        self.window = []
+        self.window_end = time.monotonic() + self.interval
+    
+    def tick(self):
+        """Fecha a janela vencida mesmo sem tráfego novo (chamado pelos shards)."""
+        with self.lock:
+            if self.window and time.monotonic() >= self.window_end:
+                self.close_window()
+    
+    def export(self):
+        with self.lock:
+            entries = list(self.entries)
+        pid = os.getpid()
+        return [{'timestamp': timestamp, 'pid': pid, 'method': method, 'path': path[:TOP_PATHS_MAX_LENGTH],
+                 'route': route, 'status': status, 'bytes': size, 'duration_seconds': round(request_time, 6),
+                 'phases': {phase: round(seconds, 6) for phase, seconds in phases},
+                 'custom_id': custom_id, 'client': client}
+                for request_time, (timestamp, method, path, route, status, size, phases, custom_id, client)
+                in entries]
+
+slow_requests = SlowRequests(SLOW_REQUESTS, SLOW_THRESHOLD, SLOW_WORST, SLOW_INTERVAL)
+
+class LogValues(dict):
+    def __missing__(self, key):
+        return '-'
+
+class AccessLog:
+    """Log de acesso assíncrono, gravado em lotes fora do caminho da requisição.
+
+    record() só enfileira os campos crus (sem formatar nada) numa fila
+    limitada; uma thread escritora formata e grava um lote quando junta
+    `batch` linhas ou a cada `flush_interval` s. Com a fila cheia a linha é
+    descartada e contada: quem atende a requisição nunca espera pelo log.
+    O formato aceita as variáveis do log_format do nginx ($remote_addr,
+    $time_local, $time_iso8601, $request, $request_method, $uri, $status,
+    $body_bytes_sent, $request_time e $http_<cabeçalho>).
+    """
+    def __init__(self, target, log_format, queue_size, batch, flush_interval, skip):
+        self.target = target
+        self.enabled = target != 'off'
+        # $variavel -> {variavel}, com as chaves literais escapadas
+        template = log_format.replace('{', '{{').replace('}', '}}')
+        self.template = re.sub(r'\$(\w+)', r'{\1}', template)
+        self.header_names = [name[len('http_'):].replace('_', '-')
+                             for name in re.findall(r'\$(http_\w+)', log_format)]
+        self.queue = queue.Queue(queue_size)
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.skip = frozenset(skip)
+        self.written = 0
+        self.dropped = 0
+        self.stream = None
+        self.thread = None
+        self.write_lock = threading.Lock()
+        # Descartes vêm das threads das requisições e da escritora
+        self.lock = threading.Lock()
+        self.time_cache = (None, '', '')
+    
+    def start(self):
+        """Abre o destino e inicia a escritora (no processo que vai atender)."""
+        if not self.enabled:
             return
-        
-        # Servir arquivos normalmente
-        # Capturar tamanho do arquivo
-        try:
-            file_path = self.translate_path(path)
-            if os.path.isfile(file_path):
-                file_size = os.path.getsize(file_path)
-                metrics.add_bytes(file_size)
-        except:
+        self.stream = sys.stdout if self.target == '-' else open(self.target, 'a')
+        self.thread = threading.Thread(target=self.run, name='access-log', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+    
+    def record(self, client, request_line, method, path, status, size, request_time, route, headers):
+        if self.thread is None or route in self.skip:
+            return
+        entry = (time.time(), client, request_line, method, path, status, size, request_time,
+                 [headers.get(name) for name in self.header_names])
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+    
+    def format_time(self, timestamp):
+        second = int(timestamp)
+        if self.time_cache[0] != second:
+            local = time.localtime(second)
+            self.time_cache = (second, time.strftime('%d/%b/%Y:%H:%M:%S %z', local),
+                               time.strftime('%Y-%m-%dT%H:%M:%S%z', local))
+        return self.time_cache
+    
+    def format(self, entry):
+        timestamp, client, request_line, method, path, status, size, request_time, header_values = entry
+        _, time_local, time_iso8601 = self.format_time(timestamp)
+        values = LogValues(remote_addr=client, time_local=time_local, time_iso8601=time_iso8601,
+                           request=request_line, request_method=method, uri=path, status=status,
+                           body_bytes_sent=size, request_time=f'{request_time:.3f}')
+        for name, value in zip(self.header_names, header_values):
+            values['http_' + name.replace('-', '_')] = value or '-'
+        return self.template.format_map(values)
+    
+    def run(self):
+        while True:
+            entries = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(entries) < self.batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entries.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.write(entries)
+    
+    def write(self, entries):
+        lines = ''.join(self.format(entry) + '\n' for entry in entries)
+        with self.write_lock:
+            try:
+                self.stream.write(lines)
+                self.stream.flush()
+                self.written += len(entries)
+            except (OSError, ValueError):
+                with self.lock:
+                    self.dropped += len(entries)
+    
+    def close(self):
+        """Grava o que ainda está na fila (chamado na saída do processo)."""
+        if self.thread is None:
+            return
+        entries = []
+        while True:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if entries:
+            self.write(entries)
+
+access_log = AccessLog(ACCESS_LOG, ACCESS_LOG_FORMAT, ACCESS_LOG_BUFFER, ACCESS_LOG_BATCH,
+                       ACCESS_LOG_FLUSH, ACCESS_LOG_SKIP)
+
+def memory_limit():
+    """Memória disponível para o processo: limite do cgroup ou MemTotal."""
+    limits = []
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limits.append(int(value))
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    limits.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+    return min(limits) if limits else 1024 ** 3
+
+class ProcessSampler:
+    """Amostragem periódica de CPU e memória do próprio processo.
+
+    Uma thread lê getrusage e /proc/self a cada `interval` s. O uso de CPU
+    sai da diferença entre duas amostras (100% = um núcleo inteiro) e a
+    memória é o RSS atual, não o pico. Também registra a CPU gasta por
+    requisição na janela, para cruzar custo com carga. Fora do Linux só os
+    campos do getrusage ficam disponíveis.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.page_size = resource.getpagesize()
+        self.memory_limit = memory_limit()
+        self.cpu_percent = 0.0
+        self.cpu_per_request = 0.0
+        # CPU e requisições da última janela, somados entre processos no /metrics
+        self.window_cpu = 0.0
+        self.window_requests = 0
+        self.rss = 0
+        self.threads = 0
+        self.open_fds = 0
+        self.voluntary_switches = 0
+        self.involuntary_switches = 0
+        self.last = None
+        self.thread = None
+    
+    def start(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name='sampler', daemon=True)
+        self.thread.start()
+    
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+    
+    def sample(self):
+        now = time.monotonic()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = usage.ru_utime + usage.ru_stime
+        requests = metrics.requests_total
+        if self.last is not None:
+            last_time, last_cpu, last_requests = self.last
+            self.cpu_percent = (cpu - last_cpu) / max(now - last_time, 1e-6) * 100
+            served = requests - last_requests
+            self.cpu_per_request = (cpu - last_cpu) / served if served else 0.0
+            self.window_cpu, self.window_requests = cpu - last_cpu, served
+        self.last = (now, cpu, requests)
+        self.voluntary_switches = usage.ru_nvcsw
+        self.involuntary_switches = usage.ru_nivcsw
+        try:
+            # /proc/self/stat: depois do "(comm)", num_threads é o 18º campo e rss o 22º
+            with open('/proc/self/stat', 'rb') as f:
+                fields = f.read().rsplit(b')', 1)[1].split()
+            self.threads = int(fields[17])
+            self.rss = int(fields[21]) * self.page_size
+            self.open_fds = len(os.listdir('/proc/self/fd'))
+        except (OSError, IndexError, ValueError):
+            self.threads = threading.active_count()
+            self.rss = usage.ru_maxrss * 1024
+
+sampler = ProcessSampler(SAMPLE_INTERVAL)
+
+class StackProfiler:
+    """Profiler por amostragem das pilhas de todas as threads do processo.
+
+    Uma sessão é uma thread que, por `seconds` s, lê sys._current_frames() a
+    cada `interval` s e conta as pilhas no formato "collapsed" (uma linha
+    por pilha, quadros separados por `;`, seguida do número de amostras),
+    que o flamegraph.pl e o speedscope leem direto. O tempo é de relógio:
+    threads bloqueadas (select, fila, accept) aparecem no quadro em que
+    esperam. Fora de uma sessão não há custo algum.
+    """
+    def __init__(self):
+        self.thread = None
+        self.deadline = 0.0
+        self.result = None
+        self.lock = threading.Lock()
+    
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def start(self, seconds, interval):
+        """Inicia uma sessão; False se já houver uma em andamento."""
+        with self.lock:
+            if self.running():
+                return False
+            self.deadline = time.monotonic() + seconds
+            self.thread = threading.Thread(target=self.run, args=(seconds, interval), name='profiler', daemon=True)
+            self.thread.start()
+        return True
+    
+    def run(self, seconds, interval):
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        while time.monotonic() < self.deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                stacks[';'.join(reversed(frames))] += 1
+            samples += 1
+            time.sleep(interval)
+        self.result = (seconds, interval, samples, stacks)
+    
+    def render(self):
+        seconds, interval, samples, stacks = self.result
+        lines = [f'# pid {os.getpid()}: {samples} amostras a cada {interval * 1000:g} ms em {seconds:g} s']
+        lines.extend(f'{stack} {count}' for stack, count in stacks.most_common())
+        return ('\n'.join(lines) + '\n').encode()
+
+class AllocationTracer:
+    """Snapshots do tracemalloc, cada um comparado com o anterior.
+
+    Desligado por padrão (o tracemalloc pesa em toda alocação enquanto
+    ativo); start liga, stop desliga e cada leitura no meio mostra as linhas
+    que mais alocaram desde a leitura anterior.
+    """
+    def __init__(self):
+        self.baseline = None
+        self.lock = threading.Lock()
+    
+    def start(self, frames):
+        with self.lock:
+            tracemalloc.start(frames)
+            self.baseline = self.snapshot()
+    
+    def stop(self):
+        with self.lock:
+            tracemalloc.stop()
+            self.baseline = None
+    
+    def snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    
+    def report(self, limit):
+        with self.lock:
+            current = self.snapshot()
+            stats = current.compare_to(self.baseline, 'lineno')
+            self.baseline = current
+        size, peak = tracemalloc.get_traced_memory()
+        lines = [f'# pid {os.getpid()}: {size} bytes rastreados (pico {peak}); diferença desde o snapshot anterior']
+        lines.extend(str(stat) for stat in stats[:limit])
+        return ('\n'.join(lines) + '\n').encode()
+
+profiler = StackProfiler()
+allocations = AllocationTracer()
+
+def render_thread_stacks():
+    names = {thread.ident: thread for thread in threading.enumerate()}
+    blocks = []
+    for ident, frame in sys._current_frames().items():
+        thread = names.get(ident)
+        title = f'Thread {thread.name if thread else ident} (ident {ident}{", daemon" if thread and thread.daemon else ""})'
+        blocks.append(title + '\n' + ''.join(traceback.format_stack(frame)))
+    return (f'# pid {os.getpid()}: {len(blocks)} threads\n\n' + '\n'.join(blocks)).encode()
+
+DEBUG_PATHS = frozenset(('/debug/profile', '/debug/tracemalloc', '/debug/threads'))
+
+def debug_response(path, query, request_headers):
+    """Endpoints /debug/*, protegidos pelo token do cabeçalho X-Debug-Token."""
+    token = request_headers.get('X-Debug-Token', '')
+    if not hmac.compare_digest(token.encode('utf-8', 'replace'), DEBUG_TOKEN.encode()):
+        return text_response(403, 'text/plain', b'403 Forbidden\n')
+    params = {name: values[-1] for name, values in parse_qs(query).items()}
+    try:
+        if path == '/debug/threads':
+            return dynamic_response(200, 'text/plain; charset=utf-8', render_thread_stacks(), request_headers)
+        if path == '/debug/profile':
+            if 'seconds' in params:
+                seconds = min(max(float(params['seconds']), 0.1), 300)
+                interval = min(max(float(params.get('interval', 10)), 1), 1000) / 1000
+                if not profiler.start(seconds, interval):
+                    return text_response(409, 'text/plain', b'409 Conflict: profiling already running\n')
+                return text_response(202, 'text/plain', f'profiling pid {os.getpid()} for {seconds:g} s\n'.encode())
+            if profiler.running():
+                left = profiler.deadline - time.monotonic()
+                return text_response(202, 'text/plain', f'profiling, {left:.1f} s left\n'.encode())
+            if profiler.result is None:
+                return text_response(404, 'text/plain', b'404 Not Found: no profile yet (use ?seconds=N)\n')
+            return dynamic_response(200, 'text/plain; charset=utf-8', profiler.render(), request_headers)
+        action = params.get('action')
+        if action == 'start':
+            allocations.start(min(max(int(params.get('frames', 1)), 1), 64))
+            return text_response(200, 'text/plain', f'tracemalloc started in pid {os.getpid()}\n'.encode())
+        if action == 'stop':
+            allocations.stop()
+            return text_response(200, 'text/plain', f'tracemalloc stopped in pid {os.getpid()}\n'.encode())
+        if not tracemalloc.is_tracing():
+            return text_response(409, 'text/plain', b'409 Conflict: tracemalloc not started (use ?action=start)\n')
+        report = allocations.report(min(max(int(params.get('limit', 25)), 1), 1000))
+        return dynamic_response(200, 'text/plain; charset=utf-8', report, request_headers)
+    except ValueError:
+        return text_response(400, 'text/plain', b'400 Bad Request\n')
+
+# Drenagem de um worker da geração anterior: não aceita novas conexões, fecha
+# as ociosas em keep-alive e responde as em andamento com Connection: close.
+# Conexão nova (já aceita) nunca é fechada sem resposta: a primeira
+# requisição é lida e respondida, com Connection: close
+draining = threading.Event()
+# Sockets parados à espera da próxima requisição (keep-alive ocioso) -> desde quando
+idle_sockets = {}
+
+def begin_drain(stop_accepting):
+    """Começa a drenagem do worker; `stop_accepting` encerra o loop de accept.
+
+    O loop de accept para antes de tudo (numa thread: shutdown() espera o
+    fim do poll); as conexões que ele ainda aceitar são atendidas uma vez.
+    """
+    if draining.is_set():
+        return
+    threading.Thread(target=stop_accepting, name='drain', daemon=True).start()
+    draining.set()
+    shutdown_idle()
+    deadline = threading.Timer(DRAIN_TIMEOUT, drain_expired)
+    deadline.daemon = True
+    deadline.start()
+
+def shutdown_idle(limit=None, idle_for=0.0):
+    """Encerra até `limit` conexões keep-alive ociosas há `idle_for` s ou mais
+    (todas, sem limite). A thread parada em cada uma recebe EOF e fica livre.
+    """
+    oldest = time.monotonic() - idle_for
+    idle = [sock for sock, since in list(idle_sockets.items()) if since <= oldest]
+    for sock in idle[:limit]:
+        idle_sockets.pop(sock, None)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
             pass
+
+def drain_expired():
+    # Prazo de drenagem vencido: sai mesmo com conexões em andamento
+    shards.close()
+    access_log.close()
+    os._exit(0)
+
+class AdmissionControl:
+    """Controle de admissão: limita o trabalho em andamento e descarta o excesso.
+
+    Até `limit` unidades são atendidas ao mesmo tempo: conexões no pool de
+    threads, requisições no motor asyncio (limit <= 0 desliga o limite). O
+    que chega além disso espera numa fila de até `queue_size` por no máximo
+    `timeout` s; com a fila cheia ou a espera vencida a resposta é 503 com
+    Retry-After na hora, em vez de a latência crescer sem limite no backlog.
+    """
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.inflight = 0
+        self.waiting = 0
+        self.queued = 0
+        self.shed = 0
+        self.wait_time = Histogram()
+        # Motor asyncio: futures dos que esperam, na ordem de chegada
+        self.waiters = deque()
+        self.lock = threading.Lock()
+    
+    def enter(self):
+        """Pool de threads, chamado no accept: None = descartar; 0.0 = vaga
+        livre agora; senão o instante em que a conexão entrou na fila."""
+        with self.lock:
+            if self.inflight < self.limit and not self.waiting:
+                self.inflight += 1
+                return 0.0
+            if self.waiting >= self.queue_size:
+                self.shed += 1
+                return None
+            self.waiting += 1
+            self.queued += 1
+            return time.monotonic()
+    
+    def start(self, ticket):
+        """Pool de threads, chamado pela thread que pegou a conexão; False se
+        a espera na fila passou do limite."""
+        if not ticket:
+            return True
+        waited = time.monotonic() - ticket
+        with self.lock:
+            self.waiting -= 1
+            self.inflight += 1
+            self.wait_time.observe(waited)
+            if waited > self.timeout:
+                self.shed += 1
+                return False
+        return True
+    
+    def expire(self, ticket):
+        """Pool de threads: a espera na fila venceu antes de uma thread pegar
+        a conexão (o loop de accept responde 503)."""
+        with self.lock:
+            self.waiting -= 1
+            self.shed += 1
+            self.wait_time.observe(time.monotonic() - ticket)
+    
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+    
+    def wait_snapshot(self):
+        with self.lock:
+            return self.wait_time.copy()
+    
+    async def acquire_async(self):
+        """Motor asyncio: espera uma vaga; retorna o tempo de fila em ns ou
+        None se a requisição deve ser descartada."""
+        if self.limit <= 0 or (self.inflight < self.limit and not self.waiters):
+            self.inflight += 1
+            return 0
+        if len(self.waiters) >= self.queue_size:
+            self.shed += 1
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        self.waiting += 1
+        self.queued += 1
+        start = time.perf_counter_ns()
+        try:
+            await asyncio.wait((future,), timeout=self.timeout)
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter_ns() - start
+        self.wait_time.observe(waited / 1e9)
+        if future.done():
+            # A vaga foi repassada por release_async
+            return waited
+        self.waiters.remove(future)
+        self.shed += 1
+        return None
+    
+    def release_async(self):
+        # Repassa a vaga ao primeiro da fila sem liberar e readquirir
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+admission = AdmissionControl(MAX_INFLIGHT, ADMISSION_QUEUE, ADMISSION_TIMEOUT)
+
+OVERLOAD_BODY = b'503 Service Unavailable\n'
+OVERLOAD_RESPONSE = (f'HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\n'
+                     f'Content-Length: {len(OVERLOAD_BODY)}\r\nRetry-After: {RETRY_AFTER}\r\n'
+                     f'Connection: close\r\n\r\n').encode() + OVERLOAD_BODY
+
+class ContentCache:
+    """Cache LRU em memória do conteúdo dos arquivos estáticos.
+
+    O total é limitado a `max_bytes`; arquivos maiores que `max_entry_bytes`
+    não são admitidos, para que um download grande não expulse o resto.
+    Cada entrada guarda o (mtime, tamanho) do arquivo e é descartada quando
+    o arquivo muda em disco.
+    """
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.entries = OrderedDict()  # caminho -> (mtime_ns, tamanho, conteúdo)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def admissible(self, size):
+        return size <= self.max_entry_bytes
+    
+    def get(self, file_path, st):
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry is not None:
+                if entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                    self.entries.move_to_end(file_path)
+                    self.hits += 1
+                    return entry[2]
+                # Arquivo alterado em disco: a entrada antiga não serve mais
+                del self.entries[file_path]
+                self.size -= len(entry[2])
+            self.misses += 1
+            return None
+    
+    def put(self, file_path, st, body):
+        with self.lock:
+            old = self.entries.pop(file_path, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.entries[file_path] = (st.st_mtime_ns, st.st_size, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[2])
+                self.evictions += 1
+
+content_cache = ContentCache(CACHE_MAX_BYTES, CACHE_MAX_ENTRY_BYTES)
+
+class MicroCache:
+    """Microcache das respostas das rotas dinâmicas (o proxy_cache de 1s do nginx).
+
+    Cada variante (rota, query e o X-Custom-ID que a resposta ecoa) vale por
+    `ttl` s. Num miss só a primeira thread gera o corpo; as que chegam com a
+    geração em andamento esperam por ela e usam o mesmo resultado
+    (single-flight), então uma rajada concorrente gera o corpo uma vez só.
+    """
+    def __init__(self, ttl, max_entries, wait_timeout=1.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.entries = OrderedDict()  # variante -> (expira em, valor)
+        self.flights = {}  # variante -> Event da geração em andamento
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key, render):
+        """Valor da variante `key` e o status do cache (HIT, MISS, COALESCED ou BYPASS)."""
+        if self.ttl <= 0:
+            return render(), 'BYPASS'
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1], 'HIT'
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = threading.Event()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.wait(self.wait_timeout)
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None:
+                return entry[1], 'COALESCED'
+            # A geração falhou ou passou do tempo: gera por conta própria
+            return render(), 'MISS'
+        try:
+            value = render()
+            with self.lock:
+                self.entries[key] = (time.monotonic() + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            return value, 'MISS'
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.set()
+
+micro_cache = MicroCache(MICRO_CACHE_TTL, MICRO_CACHE_MAX_ENTRIES)
+
+def cached_response(key, render, request_headers):
+    """Resposta dinâmica pelo microcache; `render` devolve (Content-Type, corpo)."""
+    (content_type, body), status = micro_cache.get(key, render)
+    response = dynamic_response(200, content_type, body, request_headers)
+    response.headers.append(('X-Cache-Status', status))
+    return response
+
+class OpenFileEntry:
+    """Resultado da resolução de um caminho da URL no open file cache.
+
+    `file_path` None indica arquivo inexistente (erro em cache) e `redirect`
+    indica um diretório pedido sem a barra final.
+    """
+    __slots__ = ('file_path', 'st', 'fd', 'redirect', 'checked')
+
+    def __init__(self, file_path=None, st=None, fd=None, redirect=False):
+        self.file_path = file_path
+        self.st = st
+        self.fd = fd
+        self.redirect = redirect
+        self.checked = 0.0
+
+class OpenFileCache:
+    """Cache de descritores abertos e stat por caminho da URL (open_file_cache).
+
+    Evita repetir a resolução do caminho, o stat e o open() a cada requisição.
+    Uma entrada vale por `valid` segundos; depois disso é revalidada com um
+    único stat e o descritor é reaproveitado se o arquivo não mudou. Erros
+    (404) também ficam em cache quando `cache_errors` está ativo. As
+    respostas recebem um dup() do descritor, então a expulsão de uma entrada
+    nunca fecha um arquivo em uso; todas as leituras usam offset explícito.
+    """
+    def __init__(self, max_entries, valid, cache_errors=True):
+        self.max_entries = max(max_entries, 1)
+        self.valid = valid
+        self.cache_errors = cache_errors
+        self.entries = OrderedDict()  # caminho da URL -> OpenFileEntry
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def lookup(self, path, count=True):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and now - entry.checked < self.valid:
+                self.entries.move_to_end(path)
+                if count:
+                    self.hits += 1
+                return entry
+            if count:
+                self.misses += 1
+        
+        # Entrada expirada: um stat basta se o arquivo continua o mesmo
+        if entry is not None and entry.fd is not None:
+            try:
+                st = os.stat(entry.file_path)
+            except OSError:
+                st = None
+            if st is not None and same_file(st, entry.st):
+                with self.lock:
+                    if entry.fd is not None and self.entries.get(path) is entry:
+                        entry.checked = now
+                        return entry
+        
+        new = self.resolve(path)
+        new.checked = now
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.close_entry(old)
+            if new.file_path is not None or self.cache_errors:
+                self.entries[path] = new
+                while len(self.entries) > self.max_entries:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.close_entry(evicted)
+        return new
+    
+    def resolve(self, path):
+        file_path = translate_path(path)
+        try:
+            st = os.stat(file_path)
+            if stat.S_ISDIR(st.st_mode):
+                if not path.endswith('/'):
+                    return OpenFileEntry(file_path, st, redirect=True)
+                file_path = os.path.join(file_path, 'index.html')
+                st = os.stat(file_path)
+            if not stat.S_ISREG(st.st_mode):
+                return OpenFileEntry()
+            fd = os.open(file_path, os.O_RDONLY)
+        except OSError:
+            return OpenFileEntry()
+        return OpenFileEntry(file_path, os.fstat(fd), fd)
+    
+    def open_file(self, entry):
+        """Abre para a resposta um arquivo próprio (dup do descritor em cache)."""
+        with self.lock:
+            if entry.fd is not None:
+                return open(os.dup(entry.fd), 'rb', buffering=0)
+        # A entrada foi expulsa enquanto isso: abre pelo caminho
+        return open(entry.file_path, 'rb', buffering=0)
+    
+    def close_entry(self, entry):
+        if entry.fd is not None:
+            os.close(entry.fd)
+            entry.fd = None
+
+def same_file(a, b):
+    return (a.st_ino == b.st_ino and a.st_dev == b.st_dev
+            and a.st_mtime_ns == b.st_mtime_ns and a.st_size == b.st_size)
+
+open_file_cache = OpenFileCache(OPEN_FILE_CACHE_MAX, OPEN_FILE_CACHE_VALID, OPEN_FILE_CACHE_ERRORS)
+
+class ColdStatic(Exception):
+    """O arquivo exige leitura integral (hash da ETag, compressão) no event loop.
+
+    Levantada só com um event loop rodando na thread: o motor asyncio repete
+    a requisição numa thread do executor em vez de travar as outras conexões.
+    Nos demais motores o trabalho acontece na própria thread da conexão.
+    """
+
+def in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+class ETagIndex:
+    """Índice de ETags fortes (hash do conteúdo) por arquivo.
+
+    A ETag de cada versão de um arquivo é calculada uma única vez; a entrada
+    só é recalculada quando o mtime ou o tamanho mudam. Assim uma
+    revalidação (304) custa uma consulta ao dicionário, sem ler o corpo.
+    """
+    def __init__(self):
+        self.entries = {}  # caminho -> (mtime_ns, tamanho, etag)
+        self.computed = 0
+        self.lock = threading.Lock()
+    
+    def get(self, file_path, st):
+        with self.lock:
+            entry = self.entries.get(file_path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry[2]
+        if in_event_loop():
+            raise ColdStatic(file_path)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(COPY_BUFSIZE * 16):
+                digest.update(chunk)
+            current = os.fstat(f.fileno())
+        etag = f'"{digest.hexdigest()}"'
+        with self.lock:
+            self.entries[file_path] = (current.st_mtime_ns, current.st_size, etag)
+            self.computed += 1
+        return etag
+
+etag_index = ETagIndex()
+
+class CompressionCache:
+    """Cache LRU das variantes comprimidas (gzip/deflate) dos arquivos estáticos.
+
+    Cada versão de um arquivo é comprimida uma única vez por codificação;
+    a entrada é descartada quando o mtime ou o tamanho do arquivo mudam.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (caminho, codificação) -> (mtime_ns, tamanho, corpo)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get(self, file_path, st, encoding):
+        key = (file_path, encoding)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if in_event_loop():
+                raise ColdStatic(file_path)
+            self.misses += 1
         
-        request_time = time.time() - request_start
-        metrics.increment_request(200, path, request_time)
-        return super().do_GET()
+        with open(file_path, 'rb') as f:
+            data = f.read()
+            current = os.fstat(f.fileno())
+        body = compress(data, encoding)
+        if len(body) <= self.max_bytes:
+            with self.lock:
+                old = self.entries.pop(key, None)
+                if old is not None:
+                    self.size -= len(old[2])
+                self.entries[key] = (current.st_mtime_ns, current.st_size, body)
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted[2])
+        return body
+
+compression_cache = CompressionCache(GZIP_CACHE_MAX_BYTES)
+
+registry = MetricsRegistry('nginx', METRICS_CACHE_SECONDS)
+
+def shared(scrape, name):
+    """Contador somado entre todos os processos (shards)."""
+    value = scrape.totals.get((name,), (0,))[0]
+    return int(value) if value.is_integer() else value
+
+def live(scrape, name):
+    """Medida do momento somada entre os processos vivos (shards)."""
+    value = scrape.totals.get(('live', name), (0,))[0]
+    return int(value) if value.is_integer() else value
+
+def shared_rate(scrape, *names):
+    total = shared(scrape, 'requests_total')
+    return sum(shared(scrape, name) for name in names) / total * 100 if total else 0.0
+
+def shared_histograms(scrape, kind, bounds):
+    histograms = {}
+    for key, values in scrape.totals.items():
+        if key[0] == kind and len(values) == len(bounds) + 3:
+            histogram = histograms[key[1:]] = Histogram(bounds)
+            histogram.counts = [int(value) for value in values[:-2]]
+            histogram.sum, histogram.count = values[-2], int(values[-1])
+    return histograms
+
+def process_shard_values():
+    """Contadores e medidas dos outros componentes do processo, para o shard."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    accepted, handled, states = connections.snapshot()
+    counters = {
+        'connections_accepted': accepted,
+        'connections_handled': handled,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'voluntary_switches': usage.ru_nvcsw,
+        'involuntary_switches': usage.ru_nivcsw,
+        'content_cache_hits': content_cache.hits,
+        'content_cache_misses': content_cache.misses,
+        'content_cache_evictions': content_cache.evictions,
+        'micro_cache_hits': micro_cache.hits,
+        'micro_cache_misses': micro_cache.misses,
+        'micro_cache_coalesced': micro_cache.coalesced,
+        'open_file_cache_hits': open_file_cache.hits,
+        'open_file_cache_misses': open_file_cache.misses,
+        'etag_computed': etag_index.computed,
+        'compression_cache_hits': compression_cache.hits,
+        'compression_cache_misses': compression_cache.misses,
+        'admission_queued': admission.queued,
+        'admission_shed': admission.shed,
+        'access_log_written': access_log.written,
+        'access_log_dropped': access_log.dropped,
+        'metrics_renders': registry.renders,
+        'metrics_cache_hits': registry.cache_hits,
+        'metrics_render_seconds': registry.render_seconds,
+    }
+    gauges = {
+        'connections_reading': states['reading'],
+        'connections_writing': states['writing'],
+        'connections_waiting': states['waiting'],
+        'resident_memory_bytes': sampler.rss,
+        'resident_memory_max_bytes': usage.ru_maxrss * 1024,
+        'threads': sampler.threads,
+        'open_fds': sampler.open_fds,
+        'cpu_percent': sampler.cpu_percent,
+        'cpu_window_seconds': sampler.window_cpu,
+        'cpu_window_requests': sampler.window_requests,
+        'content_cache_entries': len(content_cache.entries),
+        'content_cache_bytes': content_cache.size,
+        'micro_cache_entries': len(micro_cache.entries),
+        'open_file_cache_entries': len(open_file_cache.entries),
+        'compression_cache_bytes': compression_cache.size,
+        'admission_inflight': admission.inflight,
+        'admission_waiting': admission.waiting,
+        'access_log_queue_length': access_log.queue.qsize(),
+    }
+    wait_time = admission.wait_snapshot()
+    return ([((name,), [value]) for name, value in counters.items()] +
+            [(('live', name), [value]) for name, value in gauges.items()] +
+            [(('admission_wait',), wait_time.counts + [wait_time.sum, wait_time.count])])
+
+def latency_samples(scrape):
+    histograms = shared_histograms(scrape, 'latency', LATENCY_BUCKETS)
+    # Exemplar de cada bucket: a requisição lenta mais recente com X-Custom-ID
+    for entry in scrape.slow:
+        histogram = histograms.get((entry['route'], f"{entry['status'] // 100}xx"))
+        if histogram is None or not entry['custom_id']:
+            continue
+        if histogram.exemplars is None:
+            histogram.exemplars = [None] * len(histogram.counts)
+        index = bisect.bisect_left(histogram.bounds, entry['duration_seconds'])
+        if histogram.exemplars[index] is None:
+            histogram.exemplars[index] = (f'custom_id="{label_value(entry["custom_id"][:64])}"',
+                                          entry['duration_seconds'], entry['timestamp'])
+    return [(f'route="{label_value(route)}",status="{status_class}"', histogram)
+            for (route, status_class), histogram in sorted(histograms.items())]
+
+def content_cache_hit_rate(scrape):
+    hits = shared(scrape, 'content_cache_hits')
+    return hits / max(hits + shared(scrape, 'content_cache_misses'), 1) * 100
+
+def micro_cache_hit_rate(scrape):
+    served = shared(scrape, 'micro_cache_hits') + shared(scrape, 'micro_cache_coalesced')
+    return served / max(served + shared(scrape, 'micro_cache_misses'), 1) * 100
+
+def top_path_samples(scrape, field):
+    rows, other = scrape.top_paths
+    samples = [(f'path="{label_value(row[0])}"', row[field]) for row in rows]
+    if field == 1:
+        samples.append(('path="other"', other))
+    return samples
+
+def phase_samples(scrape):
+    return [(f'route="{label_value(route)}",phase="{phase}"', histogram)
+            for (route, phase), histogram in sorted(shared_histograms(scrape, 'phase', PHASE_BUCKETS).items())]
+
+registry.counter('http_requests_total', 'Total HTTP requests', lambda scrape: shared(scrape, 'requests_total'), labels='aluno="Hermeson_A",matricula="20239035382"')
+registry.counter('http_response_size_bytes', 'Total bytes sent', lambda scrape: shared(scrape, 'bytes_sent'))
+registry.gauge('http_connections_active', 'Active connections', lambda scrape: sum(live(scrape, f'connections_{state}') for state in ConnectionStats.STATES))
+registry.counter('http_connections_accepted_total', 'Connections accepted on the listening socket', lambda scrape: shared(scrape, 'connections_accepted'))
+registry.counter('http_connections_handled_total', 'Accepted connections that reached a worker', lambda scrape: shared(scrape, 'connections_handled'))
+registry.gauge('http_connections_reading', 'Connections reading a request', lambda scrape: live(scrape, 'connections_reading'))
+registry.gauge('http_connections_writing', 'Connections routing or sending a response', lambda scrape: live(scrape, 'connections_writing'))
+registry.gauge('http_connections_waiting', 'Idle keep-alive connections waiting for a request', lambda scrape: live(scrape, 'connections_waiting'))
+registry.counter('process_uptime_seconds', 'Server uptime in seconds', lambda scrape: scrape.uptime, '.2f')
+registry.counter('process_cpu_seconds_total', 'Total user and system CPU time spent in seconds', lambda scrape: shared(scrape, 'cpu_seconds'), '.2f')
+registry.gauge('process_resident_memory_bytes', 'Resident memory size in bytes', lambda scrape: live(scrape, 'resident_memory_bytes'))
+registry.gauge('process_resident_memory_max_bytes', 'Sum of the peak resident memory of each live process in bytes', lambda scrape: live(scrape, 'resident_memory_max_bytes'))
+registry.gauge('process_threads', 'OS threads in the server process', lambda scrape: live(scrape, 'threads'))
+registry.gauge('process_open_fds', 'Open file descriptors', lambda scrape: live(scrape, 'open_fds'))
+registry.counter('process_voluntary_context_switches_total', 'Voluntary context switches (blocking waits)', lambda scrape: shared(scrape, 'voluntary_switches'))
+registry.counter('process_involuntary_context_switches_total', 'Involuntary context switches (preemptions)', lambda scrape: shared(scrape, 'involuntary_switches'))
+registry.gauge('process_cpu_seconds_per_request', 'CPU seconds per request over the last sampling window', lambda scrape: live(scrape, 'cpu_window_seconds') / max(live(scrape, 'cpu_window_requests'), 1), '.6f')
+registry.counter('http_requests_2xx', 'HTTP requests with 2xx status', lambda scrape: shared(scrape, 'requests_2xx'))
+registry.counter('http_requests_3xx', 'HTTP requests with 3xx status (redirects and 304 revalidations)', lambda scrape: shared(scrape, 'requests_3xx'))
+registry.counter('http_requests_4xx', 'HTTP requests with 4xx status', lambda scrape: shared(scrape, 'requests_4xx'))
+registry.counter('http_requests_5xx', 'HTTP requests with 5xx status', lambda scrape: shared(scrape, 'requests_5xx'))
+registry.register('http_timeouts_total', 'counter', 'Connections closed by a timeout (header: slow request headers, send: stalled response, keepalive: idle between requests)',
+                  lambda scrape: [(f'kind="{kind}"', shared(scrape, f'timeouts_{kind}')) for kind in TIMEOUT_KINDS], labeled=True)
+registry.gauge('http_request_duration_seconds', 'Average duration of the last requests of each live process',
+               lambda scrape: live(scrape, 'request_window_seconds') / max(live(scrape, 'request_window_count'), 1), '.4f')
+registry.register('http_request_latency_seconds', 'histogram', 'Request latency by route and status class',
+                  lambda scrape: latency_samples(scrape), labeled=True)
+registry.register('http_request_phase_seconds', 'histogram', 'Time spent in each request phase (parse, route, open, write) by route',
+                  lambda scrape: phase_samples(scrape), labeled=True, buckets=PHASE_BUCKETS)
+registry.register('http_top_path_requests', 'gauge', 'Requests for the top-K paths (guaranteed count; "other" holds the rest)',
+                  lambda scrape: top_path_samples(scrape, 1), labeled=True)
+registry.register('http_top_path_latency_avg_seconds', 'gauge', 'Average latency of the top-K paths since they entered the table',
+                  lambda scrape: top_path_samples(scrape, 2), '.6f', labeled=True)
+registry.register('http_top_path_latency_max_seconds', 'gauge', 'Maximum latency of the top-K paths since they entered the table',
+                  lambda scrape: top_path_samples(scrape, 3), '.6f', labeled=True)
+registry.gauge('http_metric_shards', 'Live process shards summed into the cross-process counters and histograms (exited processes are folded into one retired shard)', lambda scrape: scrape.shards)
+registry.gauge('http_server_generation', 'Worker generation (incremented by each graceful restart)', lambda scrape: registry.generation)
+registry.gauge('http_requests_per_second', 'Requests per second', lambda scrape: shared(scrape, 'requests_total') / max(scrape.uptime, 0.001), '.2f')
+registry.gauge('http_bytes_per_second', 'Bytes sent per second', lambda scrape: shared(scrape, 'bytes_sent') / max(scrape.uptime, 0.001), '.2f')
+registry.counter('nginx_cache_hits', 'Cache hits', lambda scrape: shared(scrape, 'content_cache_hits'))
+registry.counter('nginx_cache_misses', 'Cache misses', lambda scrape: shared(scrape, 'content_cache_misses'))
+registry.counter('nginx_cache_evictions_total', 'Cache entries evicted by the LRU policy', lambda scrape: shared(scrape, 'content_cache_evictions'))
+registry.gauge('nginx_cache_entries', 'Files currently held in the cache', lambda scrape: live(scrape, 'content_cache_entries'))
+registry.gauge('nginx_cache_size', 'Current cache size in bytes', lambda scrape: live(scrape, 'content_cache_bytes'))
+registry.gauge('nginx_cache_max_bytes', 'Cache byte budget', lambda scrape: content_cache.max_bytes)
+registry.gauge('nginx_cache_hit_rate', 'Cache hit rate percentage', lambda scrape: content_cache_hit_rate(scrape), '.2f')
+registry.counter('http_static_sendfile_bytes_total', 'Static file bytes sent with zero-copy sendfile', lambda scrape: shared(scrape, 'sendfile_bytes'))
+registry.counter('http_static_buffered_bytes_total', 'Static file bytes copied through user-space buffers', lambda scrape: shared(scrape, 'buffered_bytes'))
+registry.counter('http_static_memory_bytes_total', 'Static file bytes sent from memory (content cache and compressed variants)', lambda scrape: shared(scrape, 'memory_bytes'))
+registry.counter('http_micro_cache_hits_total', 'Dynamic responses served from the micro-cache', lambda scrape: shared(scrape, 'micro_cache_hits'))
+registry.counter('http_micro_cache_misses_total', 'Dynamic responses rendered on a micro-cache miss', lambda scrape: shared(scrape, 'micro_cache_misses'))
+registry.counter('http_micro_cache_coalesced_total', 'Concurrent misses that waited for an in-flight render (single-flight)', lambda scrape: shared(scrape, 'micro_cache_coalesced'))
+registry.gauge('http_micro_cache_entries', 'Variants held in the micro-cache', lambda scrape: live(scrape, 'micro_cache_entries'))
+registry.gauge('http_micro_cache_hit_rate', 'Micro-cache hit rate percentage (hits and coalesced)', lambda scrape: micro_cache_hit_rate(scrape), '.2f')
+registry.counter('http_open_file_cache_hits_total', 'Static lookups answered by the open file cache', lambda scrape: shared(scrape, 'open_file_cache_hits'))
+registry.counter('http_open_file_cache_misses_total', 'Static lookups that resolved the path on disk', lambda scrape: shared(scrape, 'open_file_cache_misses'))
+registry.gauge('http_open_file_cache_entries', 'Entries in the open file cache', lambda scrape: live(scrape, 'open_file_cache_entries'))
+registry.counter('http_etag_computed_total', 'Strong ETags computed (once per file version)', lambda scrape: shared(scrape, 'etag_computed'))
+registry.counter('http_compression_input_bytes_total', 'Bytes fed to the gzip/deflate compressor', lambda scrape: shared(scrape, 'compression_in_bytes'))
+registry.counter('http_compression_output_bytes_total', 'Compressed bytes produced', lambda scrape: shared(scrape, 'compression_out_bytes'))
+registry.gauge('http_compression_ratio', 'Compression ratio (input bytes / output bytes)', lambda scrape: shared(scrape, 'compression_in_bytes') / max(shared(scrape, 'compression_out_bytes'), 1), '.2f')
+registry.counter('http_compression_cpu_seconds_total', 'CPU time spent compressing', lambda scrape: shared(scrape, 'compression_cpu_seconds'), '.6f')
+registry.counter('http_compression_cache_hits_total', 'Compressed static variants served from the cache', lambda scrape: shared(scrape, 'compression_cache_hits'))
+registry.counter('http_compression_cache_misses_total', 'Static variants compressed on demand', lambda scrape: shared(scrape, 'compression_cache_misses'))
+registry.gauge('http_compression_cache_size_bytes', 'Bytes held by the compressed variant cache', lambda scrape: live(scrape, 'compression_cache_bytes'))
+registry.gauge('http_success_rate', 'HTTP success rate percentage (2xx + 3xx)', lambda scrape: shared_rate(scrape, 'requests_2xx', 'requests_3xx'), '.2f')
+registry.gauge('http_error_rate', 'HTTP error rate percentage (4xx + 5xx)', lambda scrape: shared_rate(scrape, 'requests_4xx', 'requests_5xx'), '.2f')
+registry.gauge('system_cpu_percent_usage', 'Process CPU usage percentage over the last sampling window (100 = one core)', lambda scrape: live(scrape, 'cpu_percent'), '.2f')
+registry.gauge('system_memory_usage_bytes', 'Current resident memory in bytes', lambda scrape: live(scrape, 'resident_memory_bytes'))
+registry.gauge('system_memory_usage_percent', 'Resident memory as a percentage of the memory limit (cgroup or host)', lambda scrape: live(scrape, 'resident_memory_bytes') / sampler.memory_limit * 100, '.2f')
+registry.gauge('http_admission_inflight', 'Connections (threads) or requests (async) being served under admission control', lambda scrape: live(scrape, 'admission_inflight'))
+registry.gauge('http_admission_limit', 'Admission control limit (0 = unlimited)', lambda scrape: admission.limit)
+registry.gauge('http_admission_waiting', 'Work waiting in the admission queue', lambda scrape: live(scrape, 'admission_waiting'))
+registry.counter('http_admission_queued_total', 'Connections or requests that had to wait in the admission queue', lambda scrape: shared(scrape, 'admission_queued'))
+registry.counter('http_admission_shed_total', 'Connections or requests rejected with 503 because of overload', lambda scrape: shared(scrape, 'admission_shed'))
+registry.register('http_admission_queue_wait_seconds', 'histogram', 'Time spent in the admission queue',
+                  lambda scrape: [('', histogram) for histogram in shared_histograms(scrape, 'admission_wait', LATENCY_BUCKETS).values()], labeled=True)
+registry.register('http_socket_option', 'gauge', 'Effective options of the listening socket (SO_SNDBUF in bytes, TCP_DEFER_ACCEPT in seconds)',
+                  lambda scrape: [(f'option="{name}"', value) for name, value in socket_settings.items()], labeled=True)
+registry.counter('http_access_log_lines_total', 'Access log lines written', lambda scrape: shared(scrape, 'access_log_written'))
+registry.counter('http_access_log_dropped_total', 'Access log lines dropped because the queue was full', lambda scrape: shared(scrape, 'access_log_dropped'))
+registry.gauge('http_access_log_queue_length', 'Access log lines waiting for the writer thread', lambda scrape: live(scrape, 'access_log_queue_length'))
+registry.counter('http_metrics_renders_total', 'Times the /metrics exposition was rendered', lambda scrape: shared(scrape, 'metrics_renders'))
+registry.counter('http_metrics_cache_hits_total', 'Scrapes answered with a cached /metrics body', lambda scrape: shared(scrape, 'metrics_cache_hits'))
+registry.counter('http_metrics_render_seconds_total', 'Time spent rendering /metrics', lambda scrape: shared(scrape, 'metrics_render_seconds'), '.6f')
+
+def render_slow_requests(query):
+    params = parse_qs(query)
+    try:
+        limit = int(params.get('limit', ['100'])[-1])
+    except ValueError:
+        limit = 100
+    return json.dumps({
+        'server': 'python-nginx',
+        'threshold_seconds': SLOW_THRESHOLD,
+        'worst_per_interval': SLOW_WORST,
+        'interval_seconds': SLOW_INTERVAL,
+        'requests': shards.slow_entries()[:max(limit, 0)]
+    }).encode()
+
+def render_api_status(x_custom_id):
+    response = {
+        'status': 'ok',
+        'server': 'python-nginx',
+        'timestamp': datetime.now().isoformat(),
+        'x_custom_id': x_custom_id
+    }
+    return json.dumps(response).encode()
+
+def render_stub_status():
+    # Somado entre processos, como o /metrics (ver MetricShards)
+    scrape = Scrape()
+    states = {state: live(scrape, f'connections_{state}') for state in ConnectionStats.STATES}
+    status = f"""Active connections: {sum(states.values())}
+server accepts handled requests
+ {shared(scrape, 'connections_accepted')} {shared(scrape, 'connections_handled')} {shared(scrape, 'requests_total')}
+Reading: {states['reading']} Writing: {states['writing']} Waiting: {states['waiting']}
+"""
+    return status.encode()
+
+class RequestTiming:
+    """Marcas perf_counter_ns das fases de uma requisição.
+
+    start: linha de requisição lida (começa o parse dos cabeçalhos); parsed:
+    cabeçalhos prontos; routed: resposta montada; done: resposta enviada por
+    inteiro. `open_ns` acumula o lookup/open de arquivos feito no roteamento
+    e `queue_ns` a espera na fila de admissão (motor asyncio), descontada
+    do parse. `retried` marca a repetição no executor após um ColdStatic,
+    cujo lookup no cache de arquivos abertos já foi contado.
+    """
+    __slots__ = ('start', 'parsed', 'routed', 'done', 'open_ns', 'queue_ns', 'retried')
+
+    def __init__(self):
+        self.start = self.parsed = self.routed = self.done = time.perf_counter_ns()
+        self.open_ns = 0
+        self.queue_ns = 0
+        self.retried = False
+
+    def phases(self):
+        """Duração (s) de cada fase, na ordem em que acontecem."""
+        phases = (('parse', (self.parsed - self.start - self.queue_ns) / 1e9),
+                  ('route', (self.routed - self.parsed - self.open_ns) / 1e9),
+                  ('open', self.open_ns / 1e9),
+                  ('write', (self.done - self.routed) / 1e9))
+        if self.queue_ns:
+            phases += (('queue', self.queue_ns / 1e9),)
+        return phases
+
+class Response:
+    """Resposta HTTP independente do motor (http.server ou asyncio).
+
+    O corpo vem em `body` (bytes) ou, para arquivos estáticos, em `file`
+    (arquivo aberto em modo binário). Nesse caso `parts` lista o que vai no
+    corpo, em ordem: bytes literais ou trechos (offset, tamanho) do arquivo,
+    o que cobre tanto o arquivo inteiro quanto respostas multipart/byteranges.
+    """
+    __slots__ = ('status', 'headers', 'body', 'file', 'parts', 'length', 'route', 'memory')
+
+    def __init__(self, status, headers=None, body=b'', file=None, parts=None, length=None):
+        self.status = status
+        self.headers = headers if headers is not None else []
+        self.body = body
+        self.file = file
+        self.length = len(body) if length is None else length
+        if file is not None and parts is None:
+            parts = [(0, self.length)]
+        self.parts = parts
+        self.route = None
+        # Corpo estático servido da memória (ver memory_response)
+        self.memory = False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def memory_response(status, headers, body):
+    """Resposta de arquivo estático cujo corpo já está em memória."""
+    response = Response(status, headers, body)
+    response.memory = True
+    return response
+
+def text_response(status, content_type, body):
+    return Response(status, [('Content-Type', content_type), ('Content-Length', str(len(body)))], body)
+
+def keepalive_headers(keep_alive, served):
+    """Cabeçalhos de controle da conexão após `served` requisições nela."""
+    if not keep_alive:
+        return [('Connection', 'close')]
+    return [('Connection', 'keep-alive'),
+            ('Keep-Alive', f'timeout={int(KEEPALIVE_TIMEOUT)}, max={KEEPALIVE_REQUESTS - served}')]
+
+def request_body_length(headers):
+    """Bytes de corpo a descartar antes da próxima requisição da conexão.
+
+    O servidor não usa corpos, mas sem descartá-los o corpo seria lido como
+    uma requisição em pipeline. None quando o corpo não pode ser delimitado
+    (Transfer-Encoding, Content-Length inválido ou acima de BODY_DISCARD_MAX):
+    a conexão fecha depois da resposta.
+    """
+    if 'Transfer-Encoding' in headers:
+        return None
+    lengths = set(headers.get_all('Content-Length', ()))
+    if not lengths:
+        return 0
+    if len(lengths) > 1:
+        return None
+    try:
+        length = int(lengths.pop())
+    except ValueError:
+        return None
+    return length if 0 <= length <= BODY_DISCARD_MAX else None
+
+def url_parts(path):
+    path = posixpath.normpath(unquote(path))
+    return [part for part in path.split('/') if part and part not in (os.curdir, os.pardir)]
+
+def translate_path(path):
+    """Converte o caminho da URL em caminho no diretório HTML (sem sair dele)."""
+    return os.path.join(os.getcwd(), *url_parts(path))
+
+def static_route(path, status):
+    """Rótulo de rota de um caminho estático, com cardinalidade limitada.
+
+    Usa o caminho normalizado (aliases como /./a e /a viram a mesma rota),
+    que só existe para arquivos reais; todos os 404 ficam em "not_found".
+    """
+    if status == 404:
+        return 'not_found'
+    return '/' + '/'.join(url_parts(path))
+
+def content_type_of(file_path):
+    return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+def compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+def negotiate_encoding(request_headers):
+    """Escolhe gzip ou deflate pelo Accept-Encoding (com q-values); None = identity."""
+    value = request_headers.get('Accept-Encoding')
+    if not value:
+        return None
+    weights = {}
+    for item in value.split(','):
+        coding, _, params = item.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    wildcard = weights.get('*', 0.0)
+    best = max(('gzip', 'deflate'), key=lambda coding: weights.get(coding, wildcard))
+    return best if weights.get(best, wildcard) > 0 else None
+
+def compress(data, encoding):
+    """Comprime `data` contabilizando tamanhos e tempo de CPU gasto."""
+    cpu_start = time.thread_time()
+    if encoding == 'gzip':
+        body = gzip.compress(data, GZIP_LEVEL, mtime=0)
+    else:
+        body = zlib.compress(data, GZIP_LEVEL)
+    metrics.add_compression(len(data), len(body), time.thread_time() - cpu_start)
+    return body
+
+def overload_response():
+    response = text_response(503, 'text/plain', OVERLOAD_BODY)
+    response.headers.append(('Retry-After', str(RETRY_AFTER)))
+    response.route = 'overloaded'
+    return response
+
+def dynamic_response(status, content_type, body, request_headers):
+    """Resposta de rota dinâmica, comprimida a cada requisição se o cliente aceitar."""
+    if not compressible(content_type) or len(body) < GZIP_MIN_LENGTH:
+        return text_response(status, content_type, body)
+    encoding = negotiate_encoding(request_headers)
+    if encoding is not None:
+        body = compress(body, encoding)
+    response = text_response(status, content_type, body)
+    response.headers.append(('Vary', 'Accept-Encoding'))
+    if encoding is not None:
+        response.headers.append(('Content-Encoding', encoding))
+    return response
+
+def metrics_response(request_headers):
+    """/metrics em OpenMetrics se o Accept pedir, senão no texto Prometheus 0.0.4."""
+    openmetrics = 'application/openmetrics-text' in request_headers.get('Accept', '')
+    encoding = negotiate_encoding(request_headers)
+    body = registry.exposition(openmetrics, encoding)
+    response = text_response(200, OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE, body)
+    response.headers.append(('Vary', 'Accept, Accept-Encoding'))
+    if encoding is not None:
+        response.headers.append(('Content-Encoding', encoding))
+    return response
+
+def parse_ranges(value, size):
+    """Interpreta um cabeçalho `Range: bytes=...` para um corpo de `size` bytes.
+
+    Retorna None quando o cabeçalho deve ser ignorado (sintaxe inválida,
+    outra unidade ou intervalos demais), [] quando nenhum intervalo é
+    satisfazível (416) e, caso contrário, a lista de (início, fim) inclusivos.
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    specs = spec.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for item in specs:
+        first, sep, last = item.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Intervalo sufixo: os últimos N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start <= end:
+            ranges.append((start, end))
+    return ranges
+
+def not_modified(request_headers, etag, mtime):
+    """Avalia If-None-Match e If-Modified-Since de um GET/HEAD.
+
+    If-None-Match tem precedência (comparação fraca, como manda a RFC 9110);
+    If-Modified-Since só é considerado quando ele não foi enviado.
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        if if_none_match.strip() == '*':
+            return True
+        return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def requested_ranges(request_headers, etag, last_modified):
+    """Retorna o cabeçalho Range a aplicar, ou None se ele não se aplica.
+
+    Com If-Range o Range só vale se o validador (ETag forte ou data) ainda
+    corresponde ao arquivo atual; caso contrário o cliente recebe o arquivo
+    inteiro.
+    """
+    value = request_headers.get('Range')
+    if value is None:
+        return None
+    if_range = request_headers.get('If-Range')
+    if if_range is not None and if_range.strip() not in (etag, last_modified):
+        return None
+    return value
+
+def static_response(request_headers, file_path, st, etag, body=None, f=None, encoding=None, vary=False):
+    """Monta a resposta 200/206/416 de um arquivo estático.
+
+    O conteúdo vem da memória (`body`, eventualmente já comprimido com
+    `encoding`) ou do arquivo aberto `f`; intervalos de arquivo viram
+    trechos (offset, tamanho) enviados por sendfile.
+    """
+    size = st.st_size if body is None else len(body)
+    content_type = content_type_of(file_path)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    headers = [('ETag', etag), ('Last-Modified', last_modified), ('Accept-Ranges', 'bytes')]
+    if vary:
+        headers.append(('Vary', 'Accept-Encoding'))
+    if encoding is not None:
+        headers.append(('Content-Encoding', encoding))
+    
+    value = requested_ranges(request_headers, etag, last_modified)
+    ranges = parse_ranges(value, size) if value is not None else None
+    if ranges is None:
+        headers += [('Content-Type', content_type), ('Content-Length', str(size))]
+        if body is not None:
+            return memory_response(200, headers, body)
+        return Response(200, headers, file=f, length=size)
+    
+    if not ranges:
+        if f is not None:
+            f.close()
+        response = text_response(416, 'text/plain', b'416 Range Not Satisfiable\n')
+        response.headers.append(('Content-Range', f'bytes */{size}'))
+        return response
+    
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        headers += [('Content-Type', content_type), ('Content-Range', f'bytes {start}-{end}/{size}'),
+                    ('Content-Length', str(length))]
+        if body is not None:
+            return memory_response(206, headers, body[start:end + 1])
+        return Response(206, headers, file=f, parts=[(start, length)], length=length)
+    
+    # Vários intervalos: multipart/byteranges
+    boundary = os.urandom(12).hex()
+    parts = []
+    for start, end in ranges:
+        parts.append((f'--{boundary}\r\nContent-Type: {content_type}\r\n'
+                      f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('latin-1'))
+        parts.append(body[start:end + 1] if body is not None else (start, end - start + 1))
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('latin-1'))
+    length = sum(len(part) if isinstance(part, bytes) else part[1] for part in parts)
+    headers += [('Content-Type', f'multipart/byteranges; boundary={boundary}'), ('Content-Length', str(length))]
+    if body is not None:
+        return memory_response(206, headers, b''.join(parts))
+    return Response(206, headers, file=f, parts=parts, length=length)
+
+def serve_static(path, request_headers, timing):
+    started = time.perf_counter_ns()
+    entry = open_file_cache.lookup(path, count=not timing.retried)
+    timing.open_ns += time.perf_counter_ns() - started
+    if entry.redirect:
+        return Response(301, [('Location', path + '/'), ('Content-Length', '0')])
+    if entry.file_path is None:
+        return text_response(404, 'text/plain', b'404 Not Found\n')
+    
+    file_path, st = entry.file_path, entry.st
+    
+    # Negociação de compressão: cada variante comprimida tem ETag própria
+    vary = compressible(content_type_of(file_path)) and GZIP_MIN_LENGTH <= st.st_size <= GZIP_MAX_LENGTH
+    encoding = negotiate_encoding(request_headers) if vary else None
+    
+    # Revalidação: responde 304 só com o índice de ETags, sem tocar no corpo
+    try:
+        etag = etag_index.get(file_path, st)
+    except OSError:
+        return text_response(404, 'text/plain', b'404 Not Found\n')
+    if encoding is not None:
+        etag = f'{etag[:-1]}-{encoding}"'
+    if not_modified(request_headers, etag, st.st_mtime):
+        headers = [('ETag', etag), ('Last-Modified', formatdate(st.st_mtime, usegmt=True))]
+        if vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        return Response(304, headers)
+    
+    if encoding is not None:
+        try:
+            body = compression_cache.get(file_path, st, encoding)
+        except OSError:
+            return text_response(404, 'text/plain', b'404 Not Found\n')
+        return static_response(request_headers, file_path, st, etag, body=body, encoding=encoding, vary=True)
+    
+    # Hit no cache: o conteúdo sai da memória, sem open()/read()
+    if content_cache.admissible(st.st_size):
+        body = content_cache.get(file_path, st)
+        if body is not None:
+            return static_response(request_headers, file_path, st, etag, body=body, vary=vary)
+    
+    started = time.perf_counter_ns()
+    try:
+        f = open_file_cache.open_file(entry)
+    except OSError:
+        return text_response(404, 'text/plain', b'404 Not Found\n')
+    finally:
+        timing.open_ns += time.perf_counter_ns() - started
+    if content_cache.admissible(st.st_size):
+        with f:
+            body = os.pread(f.fileno(), st.st_size, 0)
+        # Só guarda se o arquivo não mudou desde o stat
+        if len(body) == st.st_size:
+            content_cache.put(file_path, st, body)
+        return static_response(request_headers, file_path, st, etag, body=body, vary=vary)
+    return static_response(request_headers, file_path, st, etag, f=f, vary=vary)
+
+def send_file(sock, f, offset, count):
+    """Envia `count` bytes de `f` (a partir de `offset`) pelo socket.
+
+    Usa os.sendfile, que copia do page cache direto para o socket sem passar
+    por buffers em espaço de usuário; se o sendfile não for suportado cai
+    para leitura/escrita em blocos. Os bytes enviados entram nas métricas
+    mesmo quando o envio é interrompido (timeout, cliente que desconectou).
+    """
+    sent = buffered = 0
+    try:
+        if hasattr(os, 'sendfile'):
+            timeout = sock.gettimeout()
+            selector = None
+            try:
+                while sent < count:
+                    try:
+                        n = os.sendfile(sock.fileno(), f.fileno(), offset + sent, count - sent)
+                    except BlockingIOError:
+                        # Socket com timeout é não bloqueante por baixo: espera o
+                        # buffer de envio esvaziar respeitando o timeout
+                        if selector is None:
+                            selector = selectors.DefaultSelector()
+                            selector.register(sock, selectors.EVENT_WRITE)
+                        if not selector.select(timeout):
+                            raise TimeoutError('timed out')
+                        continue
+                    if n == 0:
+                        break
+                    sent += n
+                return
+            except OSError as e:
+                if sent or e.errno not in SENDFILE_UNSUPPORTED:
+                    raise
+            finally:
+                if selector is not None:
+                    selector.close()
+        while buffered < count:
+            chunk = os.pread(f.fileno(), min(COPY_BUFSIZE, count - buffered), offset + buffered)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+            buffered += len(chunk)
+    finally:
+        metrics.add_static_transfer(sent, buffered)
+
+def handle_request(method, path, headers, timing, query=''):
+    """Roteia uma requisição; usado pelos dois motores.
+
+    As métricas só são registradas por record_request, depois do envio.
+    """
+    timing.parsed = time.perf_counter_ns()
+    
+    x_custom_id = headers.get('X-Custom-ID', 'N/A')
+    
+    route = path
+    if method not in ('GET', 'HEAD'):
+        response = text_response(501, 'text/plain', b'501 Not Implemented\n')
+        route = 'other'
+    # Endpoint de métricas Prometheus
+    elif path == '/metrics':
+        response = metrics_response(headers)
+    # Endpoint de status da API
+    elif path == '/api/status':
+        response = cached_response((path, x_custom_id), lambda: ('application/json', render_api_status(x_custom_id)), headers)
+    # Requisições lentas (todas as instâncias), com X-Custom-ID
+    elif path == '/api/slow-requests':
+        response = cached_response((path, query), lambda: ('application/json', render_slow_requests(query)), headers)
+    # Stub status para métricas
+    elif path == '/stub_status':
+        response = cached_response((path,), lambda: ('text/plain', render_stub_status()), headers)
+    # Depuração (profiling, alocações, pilhas), só com SERVER_DEBUG_TOKEN
+    elif DEBUG_TOKEN and path in DEBUG_PATHS:
+        response = debug_response(path, query, headers)
+    # Servir arquivos normalmente
+    else:
+        response = serve_static(path, headers, timing)
+        route = static_route(path, response.status)
+    
+    response.route = route
+    timing.routed = time.perf_counter_ns()
+    return response
+
+def record_request(method, path, response, timing, client, request_line, headers):
+    """Registra a requisição (métricas e log) com a resposta já enviada."""
+    timing.done = time.perf_counter_ns()
+    request_time = (timing.done - timing.start) / 1e9
+    phases = timing.phases()
+    metrics.increment_request(response.status, path, request_time, response.route, phases)
+    size = 0 if method == 'HEAD' else response.length
+    metrics.add_bytes(size)
+    if response.memory:
+        metrics.add_static_transfer(0, 0, size)
+    slow_requests.offer(request_time, time.time(), method, path, response.route, response.status, size,
+                        phases, headers.get('X-Custom-ID'), client)
+    access_log.record(client, request_line, method, path, response.status, size, request_time,
+                      response.route, headers)
+
+class HeaderTimeoutIO(socket.SocketIO):
+    """Leitura do socket com prazo total para o cabeçalho da requisição.
+
+    O timeout do socket vale para cada recv: um cliente que manda um byte a
+    cada poucos segundos nunca o dispara e prende a conexão indefinidamente.
+    Com `deadline` definido, cada leitura espera só o que resta do prazo.
+    """
+    deadline = None
+
+    def readinto(self, b):
+        if self.deadline is not None:
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.add_timeout('header')
+                raise TimeoutError('header timeout')
+            self._sock.settimeout(remaining)
+        try:
+            return super().readinto(b)
+        except TimeoutError:
+            if self.deadline is not None:
+                metrics.add_timeout('header')
+            raise
+
+class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Conexões persistentes: o loop de handle() atende em ordem as requisições
+    # que chegam na mesma conexão (inclusive em pipeline) até o cliente fechar,
+    # o limite de requisições ser atingido ou a conexão ficar ociosa.
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    
+    def setup(self):
+        super().setup()
+        # Cabeçalho e corpo saem em escritas separadas; sem TCP_NODELAY o
+        # algoritmo de Nagle segura a segunda escrita até o ACK atrasado do
+        # cliente (~40ms por resposta em conexões keep-alive)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(TCP_NODELAY))
+        self.requests_served = 0
+        self.state = connections.open()
+        self.rfile.close()
+        self.reader = HeaderTimeoutIO(self.connection, 'rb')
+        self.rfile = io.BufferedReader(self.reader)
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            connections.close(self.state)
+    
+    def handle_one_request(self):
+        # Bloqueado à espera do primeiro byte da requisição = keep-alive ocioso
+        # (a primeira requisição de uma conexão nova sempre é lida)
+        self.state = connections.move(self.state, 'waiting')
+        if self.requests_served:
+            idle_sockets[self.connection] = time.monotonic()
+        try:
+            if draining.is_set() and self.requests_served:
+                self.close_connection = True
+                return
+            # Até o primeiro byte vale a ociosidade do keep-alive (ou o prazo do
+            # cabeçalho na primeira requisição); depois, o prazo total do cabeçalho
+            self.reader.deadline = None
+            self.connection.settimeout(KEEPALIVE_TIMEOUT if self.requests_served else HEADER_TIMEOUT)
+            waiting_since = time.monotonic()
+            try:
+                pending = self.rfile.peek(1)
+            except TimeoutError:
+                metrics.add_timeout('keepalive' if self.requests_served else 'header')
+                self.close_connection = True
+                return
+            if not pending:
+                self.close_connection = True
+                return
+            idle_sockets.pop(self.connection, None)
+            self.reader.deadline = (time.monotonic() if self.requests_served else waiting_since) + HEADER_TIMEOUT
+            super().handle_one_request()
+        finally:
+            idle_sockets.pop(self.connection, None)
+    
+    def parse_request(self):
+        # A linha de requisição já foi lida; daqui em diante é parse
+        idle_sockets.pop(self.connection, None)
+        self.state = connections.move(self.state, 'reading')
+        self.timing = RequestTiming()
+        return super().parse_request()
+    
+    def do_GET(self):
+        # Corpo (raro em GET/HEAD) descartado ainda sob o prazo do cabeçalho
+        body_length = request_body_length(self.headers)
+        if body_length is None:
+            self.close_connection = True
+        elif body_length:
+            self.rfile.read(body_length)
+        # Cabeçalho completo: no envio vale a inatividade máxima por escrita
+        self.reader.deadline = None
+        self.connection.settimeout(SEND_TIMEOUT)
+        self.state = connections.move(self.state, 'writing')
+        url = urlparse(self.path)
+        path = url.path
+        response = handle_request(self.command, path, self.headers, self.timing, url.query)
+        self.requests_served += 1
+        # Com conexões na fila de admissão, não segura a thread em keep-alive
+        if self.requests_served >= KEEPALIVE_REQUESTS or admission.waiting or draining.is_set():
+            self.close_connection = True
+        try:
+            self.send_response(response.status)
+            for name, value in response.headers + keepalive_headers(not self.close_connection, self.requests_served):
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command == 'HEAD':
+                return
+            if response.file is not None:
+                for part in response.parts:
+                    if isinstance(part, bytes):
+                        self.wfile.write(part)
+                    else:
+                        send_file(self.connection, response.file, *part)
+            else:
+                self.wfile.write(response.body)
+            self.wfile.flush()
+        except TimeoutError:
+            # O handle_one_request base fecha a conexão
+            metrics.add_timeout('send')
+            raise
+        finally:
+            response.close()
+            record_request(self.command, path, response, self.timing, self.client_address[0],
+                           self.requestline, self.headers)
+    
+    do_HEAD = do_GET
     
     def log_message(self, format, *args):
         # Log customizado
         pass
 
+async def send_file_async(loop, writer, f, offset, count):
+    """Versão asyncio de send_file: sendfile nativo com fallback em buffer.
+
+    Um cliente que para de ler estoura o SEND_TIMEOUT de um bloco
+    (asyncio.TimeoutError) em vez de prender a conexão.
+    """
+    sent = buffered = 0
+    try:
+        while sent < count:
+            chunk_sent = await asyncio.wait_for(
+                loop.sendfile(writer.transport, f, offset + sent, min(ASYNC_SENDFILE_CHUNK, count - sent), fallback=False),
+                SEND_TIMEOUT)
+            if not chunk_sent:
+                break
+            sent += chunk_sent
+    except asyncio.SendfileNotAvailableError:
+        while buffered < count:
+            chunk = os.pread(f.fileno(), min(COPY_BUFSIZE, count - buffered), offset + buffered)
+            if not chunk:
+                break
+            writer.write(chunk)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+            buffered += len(chunk)
+    finally:
+        metrics.add_static_transfer(sent, buffered)
+
+async def handle_connection(reader, writer):
+    """Atende uma conexão no motor asyncio, com keep-alive HTTP/1.1."""
+    loop = asyncio.get_running_loop()
+    served = 0
+    client = writer.get_extra_info('peername', ('-',))[0]
+    # O asyncio liga TCP_NODELAY em toda conexão; aplica a configuração
+    writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(TCP_NODELAY))
+    connections.accept()
+    state = connections.open()
+    try:
+        while True:
+            state = connections.move(state, 'waiting')
+            # Em drenagem só fecha keep-alive ocioso: a primeira requisição de
+            # uma conexão nova (aceita no mesmo lote) é lida e respondida
+            if served:
+                if draining.is_set():
+                    break
+                idle_writers.add(writer)
+            # Até o primeiro byte vale a ociosidade do keep-alive (ou o prazo do
+            # cabeçalho na primeira requisição); depois, o prazo total do cabeçalho
+            waiting_since = loop.time()
+            try:
+                first = await asyncio.wait_for(reader.read(1), KEEPALIVE_TIMEOUT if served else HEADER_TIMEOUT)
+            except asyncio.TimeoutError:
+                metrics.add_timeout('keepalive' if served else 'header')
+                break
+            idle_writers.discard(writer)
+            if not first:
+                break
+            state = connections.move(state, 'reading')
+            deadline = (loop.time() if served else waiting_since) + HEADER_TIMEOUT
+            request_line = None
+            try:
+                request_line = first + await asyncio.wait_for(reader.readline(), deadline - loop.time())
+                timing = RequestTiming()
+                raw_headers = b''
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), deadline - loop.time())
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    raw_headers += line
+            except asyncio.TimeoutError:
+                metrics.add_timeout('header')
+                break
+            except (asyncio.LimitOverrunError, ValueError):
+                # Linha acima do limite do StreamReader: 414 na linha de
+                # requisição, 431 num cabeçalho (como o handler de threads)
+                if request_line is None:
+                    writer.write(b'HTTP/1.1 414 URI Too Long\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                else:
+                    writer.write(b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            try:
+                request_line = request_line.decode('iso-8859-1').rstrip('\r\n')
+                method, target, version = request_line.split()
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            try:
+                headers = http.client.parse_headers(io.BytesIO(raw_headers + b'\r\n'))
+            except http.client.HTTPException:
+                # Mais de 100 cabeçalhos ou linha longa demais (LineTooLong)
+                writer.write(b'HTTP/1.1 431 Request Header Fields Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            connection = headers.get('Connection', '').lower()
+            if version == 'HTTP/1.1':
+                keep_alive = connection != 'close'
+            else:
+                keep_alive = connection == 'keep-alive'
+            # Corpo descartado para não ser lido como a próxima requisição; sem
+            # como delimitá-lo, ou em métodos não suportados (501), fecha a conexão
+            body_length = request_body_length(headers)
+            if body_length is None or method not in ('GET', 'HEAD'):
+                keep_alive = False
+            elif body_length:
+                try:
+                    await asyncio.wait_for(reader.readexactly(body_length), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    metrics.add_timeout('header')
+                    break
+                except asyncio.IncompleteReadError:
+                    break
+            
+            url = urlparse(target)
+            path = url.path
+            state = connections.move(state, 'writing')
+            queue_ns = await admission.acquire_async()
+            # A vaga de admissão volta mesmo se o roteamento ou a escrita falharem
+            try:
+                if queue_ns is None:
+                    response = overload_response()
+                    timing.parsed = timing.routed = time.perf_counter_ns()
+                    keep_alive = False
+                else:
+                    timing.queue_ns = queue_ns
+                    try:
+                        response = handle_request(method, path, headers, timing, url.query)
+                    except ColdStatic:
+                        # Primeira requisição da versão do arquivo: hash e compressão
+                        # numa thread do executor, com o event loop livre
+                        timing.open_ns = 0
+                        timing.retried = True
+                        response = await loop.run_in_executor(None, handle_request, method, path, headers,
+                                                              timing, url.query)
+                served += 1
+                if served >= KEEPALIVE_REQUESTS or draining.is_set():
+                    keep_alive = False
+                try:
+                    head = [f'HTTP/1.1 {response.status} {http.HTTPStatus(response.status).phrase}',
+                            'Server: python-nginx',
+                            f'Date: {formatdate(usegmt=True)}']
+                    head.extend(f'{name}: {value}' for name, value in response.headers + keepalive_headers(keep_alive, served))
+                    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+                    if method != 'HEAD':
+                        if response.file is not None:
+                            for part in response.parts:
+                                if isinstance(part, bytes):
+                                    writer.write(part)
+                                else:
+                                    await send_file_async(loop, writer, response.file, *part)
+                        else:
+                            writer.write(response.body)
+                    await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    metrics.add_timeout('send')
+                    keep_alive = False
+                finally:
+                    response.close()
+                    record_request(method, path, response, timing, client, request_line, headers)
+            finally:
+                if queue_ns is not None:
+                    admission.release_async()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        idle_writers.discard(writer)
+        connections.close(state)
+        writer.close()
+
+# Conexões do motor asyncio paradas à espera da próxima requisição
+idle_writers = set()
+
+def make_listener(port):
+    """Abre o socket de escuta do motor asyncio (no mestre, antes do fork)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    tune_listener(sock)
+    sock.bind(('', port))
+    sock.listen(BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+async def serve_async(sock):
+    loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle_connection, sock=sock, backlog=BACKLOG)
+    drained = asyncio.Event()
+    
+    async def wait_drained():
+        deadline = loop.time() + DRAIN_TIMEOUT
+        while connections.active() and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        drained.set()
+    
+    def drain():
+        if draining.is_set():
+            return
+        # Para de aceitar antes de drenar
+        server.close()
+        draining.set()
+        for writer in list(idle_writers):
+            writer.close()
+        loop.create_task(wait_drained())
+    
+    loop.add_signal_handler(signal.SIGQUIT, drain)
+    await drained.wait()
+
+# Valores efetivos das opções do socket de escuta (lidos de volta com getsockopt)
+socket_settings = {}
+
+def tune_listener(sock):
+    """Aplica as opções configuradas ao socket de escuta (antes do bind).
+
+    SO_SNDBUF e TCP_NODELAY são herdados pelas conexões aceitas; o kernel
+    dobra o SO_SNDBUF pedido e arredonda o TCP_DEFER_ACCEPT, por isso o que
+    vai para /metrics é o valor lido de volta.
+    """
+    if REUSEPORT and hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(TCP_NODELAY))
+    if SNDBUF > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF)
+    if DEFER_ACCEPT > 0 and hasattr(socket, 'TCP_DEFER_ACCEPT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, DEFER_ACCEPT)
+    
+    socket_settings['backlog'] = BACKLOG
+    socket_settings['so_reuseport'] = (sock.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT)
+                                       if hasattr(socket, 'SO_REUSEPORT') else 0)
+    socket_settings['tcp_nodelay'] = int(bool(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)))
+    socket_settings['so_sndbuf'] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    socket_settings['tcp_defer_accept'] = (sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT)
+                                           if hasattr(socket, 'TCP_DEFER_ACCEPT') else 0)
+
+class CountingTCPServer(socketserver.TCPServer):
+    """TCPServer que conta as conexões aceitas (base dos modos do servidor)."""
+    allow_reuse_address = True
+    request_queue_size = BACKLOG
+
+    def server_bind(self):
+        tune_listener(self.socket)
+        super().server_bind()
+
+    def get_request(self):
+        request = super().get_request()
+        connections.accept()
+        return request
+
+class ThreadPoolTCPServer(CountingTCPServer):
+    """TCPServer que despacha cada conexão para um pool limitado de threads.
+
+    O loop de accept nunca bloqueia: com todas as threads ocupadas a conexão
+    entra na fila de admissão (a fila do executor, limitada por
+    ADMISSION_QUEUE) e, com ela cheia, recebe 503 na hora. Cada conexão na
+    fila libera uma thread parada em keep-alive ocioso, e o próprio loop de
+    accept responde 503 às que passam de ADMISSION_TIMEOUT sem thread.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='worker')
+        # No pool, cada thread atende uma conexão: o limite é o tamanho do pool
+        admission.limit = max_workers
+        # Conexões na fila, em ordem de chegada: (entrada, socket, posse); quem
+        # adquire a posse primeiro (thread do pool ou prazo vencido) a atende
+        self.queued = deque()
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        ticket = admission.enter()
+        if ticket is None:
+            self.reject(request)
+            self.shutdown_request(request)
+            return
+        claim = None
+        if ticket:
+            claim = threading.Lock()
+            self.queued.append((ticket, request, claim))
+        self.executor.submit(self.process_request_thread, request, client_address, ticket, claim)
+
+    def service_actions(self):
+        # Loop de accept (a cada conexão ou poll_interval): libera threads
+        # paradas em keep-alive ocioso para a fila, descarta a cabeça da fila
+        # já atendida e responde 503 às esperas vencidas
+        if admission.waiting:
+            shutdown_idle(admission.waiting, ADMISSION_IDLE_GRACE)
+        now = time.monotonic()
+        while self.queued:
+            ticket, request, claim = self.queued[0]
+            if not claim.locked() and now - ticket <= admission.timeout:
+                break
+            self.queued.popleft()
+            if claim.acquire(blocking=False):
+                admission.expire(ticket)
+                self.reject(request)
+                self.shutdown_request(request)
+
+    def process_request_thread(self, request, client_address, ticket, claim):
+        if claim is not None and not claim.acquire(blocking=False):
+            # Recusada pelo loop de accept com a espera vencida
+            return
+        try:
+            if admission.start(ticket):
+                self.finish_request(request, client_address)
+            else:
+                self.reject(request)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            admission.release()
+
+    def reject(self, request):
+        """Responde 503 sem ler a requisição (a conexão é fechada em seguida)."""
+        try:
+            request.sendall(OVERLOAD_RESPONSE)
+        except OSError:
+            pass
+
+    def serve_forever(self, poll_interval=0.5):
+        # Acorda a tempo de cumprir o prazo da fila de admissão
+        super().serve_forever(min(poll_interval, max(admission.timeout / 4, 0.05)))
+        # Loop de accept encerrado pela drenagem: espera as conexões do pool
+        self.executor.shutdown(wait=True)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+class SingleTCPServer(CountingTCPServer):
+    pass
+
+def serve_threads(httpd):
+    """Corpo do worker nos modos single e threads."""
+    signal.signal(signal.SIGQUIT, lambda signum, frame: begin_drain(httpd.shutdown))
+    httpd.serve_forever()
+
+class Master:
+    """Processo mestre: segura o socket de escuta e mantém um worker vivo.
+
+    O worker herda o socket pelo fork. Com SIGHUP o mestre cria um worker de
+    uma nova geração (que passa a aceitar conexões no mesmo socket) e manda
+    SIGQUIT aos antigos, que param de aceitar, terminam o que está em
+    andamento (até SERVER_DRAIN_TIMEOUT) e saem: nenhuma conexão é recusada.
+    """
+
+    def __init__(self, serve):
+        self.serve = serve
+        self.children = {}
+        self.stopping = False
+
+    def spawn_worker(self):
+        # Evita que o buffer de stdout do mestre seja duplicado nos filhos
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            # Threads não sobrevivem ao fork: log e amostrador nascem no worker
+            access_log.start()
+            sampler.start()
+            shards.start()
+            try:
+                self.serve()
+            finally:
+                shards.close()
+                access_log.close()
+                os._exit(0)
+        self.children[pid] = registry.generation
+
+    def graceful_restart(self, signum, frame):
+        old = list(self.children)
+        registry.set_generation(registry.generation + 1)
+        print(f"SIGHUP: iniciando geração {registry.generation}, drenando {len(old)} worker(s)")
+        self.spawn_worker()
+        for pid in old:
+            try:
+                os.kill(pid, signal.SIGQUIT)
+            except ProcessLookupError:
+                pass
+
+    def stop_workers(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop_workers)
+        signal.signal(signal.SIGINT, self.stop_workers)
+        signal.signal(signal.SIGHUP, self.graceful_restart)
+        while True:
+            if not self.stopping and registry.generation not in self.children.values():
+                self.spawn_worker()
+            if not self.children:
+                break
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            self.children.pop(pid, None)
+            shards.retire()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Servidor Python (Nginx)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--html-dir', default=HTML_DIR)
+    parser.add_argument('--mode', choices=['single', 'threads', 'async'], default=SERVER_MODE,
+                        help='modelo de concorrência (env SERVER_MODE)')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS,
+                        help='tamanho do pool de threads (env SERVER_WORKERS)')
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     # Mudar para o diretório com os arquivos HTML
-    os.chdir('/app/html')
-    
-    with socketserver.TCPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
-        print(f"========================================")
-        print(f"Servidor Python (Nginx) rodando na porta {PORT}")
-        print(f"Aluno: Hermeson A.")
-        print(f"Matrícula: 20239035382")
-        print(f"========================================")
-        httpd.serve_forever()
+    os.chdir(args.html_dir)
+    
+    print(f"========================================")
+    print(f"Servidor Python (Nginx) rodando na porta {args.port}")
+    print(f"Modo: {args.mode} ({args.workers if args.mode == 'threads' else 1} workers)")
+    print(f"Aluno: Hermeson A.")
+    print(f"Matrícula: 20239035382")
+    print(f"========================================")
+    shards.setup()
+    
+    if args.mode == 'async':
+        sock = make_listener(args.port)
+        with sock:
+            Master(lambda: asyncio.run(serve_async(sock))).run()
+        return
+    
+    if args.mode == 'threads':
+        httpd = ThreadPoolTCPServer(("", args.port), CustomHTTPRequestHandler, args.workers)
+    else:
+        httpd = SingleTCPServer(("", args.port), CustomHTTPRequestHandler)
+    
+    with httpd:
+        Master(lambda: serve_threads(httpd)).run()
 
 if __name__ == '__main__':
     main()